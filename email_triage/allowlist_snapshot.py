@@ -0,0 +1,173 @@
+"""
+Snapshot compacto de la lista de emails válidos.
+
+Un único objeto S3 contiene un filtro de Bloom y un array exacto ordenado con
+los emails normalizados. La Lambda lo deserializa una vez por contenedor; las
+búsquedas consultan primero el filtro y solo en caso positivo el array exacto
+(búsqueda binaria), de modo que memoria y arranque en frío no crecen con el
+tamaño de la tabla.
+
+Formato (little-endian):
+    cabecera  <4s H I B I I>: magic, versión, num_bits, num_hashes, count,
+                              longitud del bloque de datos
+    filtro    num_bits / 8 bytes
+    offsets   (count + 1) uint32
+    datos     emails utf-8 concatenados en orden
+
+Uso (paso de build):
+    python email_triage/allowlist_snapshot.py --bucket <bucket> --key <key>
+"""
+import argparse
+import hashlib
+import logging
+import math
+import struct
+import sys
+from array import array
+
+from resilience import call
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+MAGIC = b"ALSN"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHIBII")
+DEFAULT_FALSE_POSITIVE_RATE = 0.01
+
+
+def normalize_email(email):
+    """
+    Normaliza un email para compararlo (sin espacios y en minúsculas).
+    """
+    return email.strip().lower()
+
+
+def _hashes(value, num_bits, num_hashes):
+    digest = hashlib.blake2b(value, digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "little")
+    h2 = int.from_bytes(digest[8:], "little") | 1
+    return [(h1 + i * h2) % num_bits for i in range(num_hashes)]
+
+
+def build_snapshot(emails, false_positive_rate=DEFAULT_FALSE_POSITIVE_RATE):
+    """
+    Serializa la lista de emails en el formato de snapshot.
+    """
+    values = sorted({normalize_email(e).encode("utf-8") for e in emails if e})
+    count = len(values)
+    num_bits = max(
+        64, int(-max(count, 1) * math.log(false_positive_rate) / math.log(2) ** 2)
+    )
+    num_bits += -num_bits % 8
+    num_hashes = max(1, round(num_bits / max(count, 1) * math.log(2)))
+
+    bloom = bytearray(num_bits // 8)
+    offsets = [0]
+    for value in values:
+        for bit in _hashes(value, num_bits, num_hashes):
+            bloom[bit >> 3] |= 1 << (bit & 7)
+        offsets.append(offsets[-1] + len(value))
+
+    data = b"".join(values)
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, num_bits, num_hashes, count, len(data)
+    )
+    # Offsets uint32 little-endian, como la cabecera
+    return header + bytes(bloom) + struct.pack(f"<{len(offsets)}I", *offsets) + data
+
+
+class AllowlistSnapshot:
+    """
+    Vista de solo lectura sobre un snapshot serializado. Soporta `in`, por lo
+    que puede usarse en lugar del set de emails en should_email_be_processed.
+    """
+
+    def __init__(self, payload):
+        buffer = memoryview(payload)
+        magic, version, num_bits, num_hashes, count, data_len = HEADER.unpack_from(
+            buffer
+        )
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("Snapshot de emails con formato no soportado")
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.count = count
+
+        start = HEADER.size
+        self.bloom = buffer[start : start + num_bits // 8]
+        start += num_bits // 8
+        offsets = buffer[start : start + (count + 1) * 4]
+        if sys.byteorder == "little" and array("I").itemsize == 4:
+            # Sin copia: el formato coincide con el nativo
+            self.offsets = offsets.cast("I")
+        else:
+            self.offsets = struct.unpack(f"<{count + 1}I", offsets)
+        start += (count + 1) * 4
+        self.data = buffer[start : start + data_len]
+
+    def __len__(self):
+        return self.count
+
+    def _item(self, index):
+        return self.data[self.offsets[index] : self.offsets[index + 1]].tobytes()
+
+    def might_contain(self, value):
+        return all(
+            self.bloom[bit >> 3] & (1 << (bit & 7))
+            for bit in _hashes(value, self.num_bits, self.num_hashes)
+        )
+
+    def __contains__(self, email):
+        if not isinstance(email, str):
+            return False
+        value = normalize_email(email).encode("utf-8")
+        if not self.might_contain(value):
+            return False
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            item = self._item(mid)
+            if item < value:
+                lo = mid + 1
+            elif item > value:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self._item(index).decode("utf-8")
+
+
+def load_snapshot(s3_client, bucket, key):
+    """
+    Descarga y deserializa el snapshot desde S3.
+    """
+    response = call("s3", s3_client.get_object, Bucket=bucket, Key=key)
+    snapshot = AllowlistSnapshot(response["Body"].read())
+    logger.info(
+        f"Snapshot de emails cargado desde s3://{bucket}/{key}: {len(snapshot)}"
+    )
+    return snapshot
+
+
+def main():
+    from app import scan_valid_emails, s3
+
+    parser = argparse.ArgumentParser(description="Construye el snapshot de emails")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--key", default="allowlist/snapshot.bin")
+    parser.add_argument(
+        "--false-positive-rate", type=float, default=DEFAULT_FALSE_POSITIVE_RATE
+    )
+    args = parser.parse_args()
+
+    payload = build_snapshot(scan_valid_emails(), args.false_positive_rate)
+    call("s3", s3.put_object, Bucket=args.bucket, Key=args.key, Body=payload)
+    print(f"Snapshot subido a s3://{args.bucket}/{args.key} ({len(payload)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
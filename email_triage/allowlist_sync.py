@@ -0,0 +1,239 @@
+"""
+Sincronización incremental de la lista de emails válidos.
+
+- stream_handler: Lambda conectada al stream de DynamoDB de la tabla de emails.
+  Por cada lote escribe un delta versionado (altas y bajas) en S3 y actualiza
+  el manifest. Cada ALLOWLIST_COMPACT_EVERY versiones compacta los deltas en un
+  nuevo snapshot versionado (formato de allowlist_snapshot.py).
+- SyncedAllowlist: usada por la Lambda de triaje. Carga el snapshot indicado en
+  el manifest y después solo descarga los deltas más nuevos que su versión.
+
+Estructura en S3:
+    allowlist/manifest.json          {version, snapshot_version, snapshot_key}
+    allowlist/snapshots/<version>.bin
+    allowlist/deltas/<version>.json  {version, added, removed}
+
+Inicialización (escanea la tabla una vez y crea el snapshot de la versión 0):
+    python email_triage/allowlist_sync.py --bucket <bucket>
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+
+import boto3
+
+from allowlist_snapshot import AllowlistSnapshot, build_snapshot, normalize_email
+from resilience import BOTO_CONFIG, call
+from snapstart import recreatable
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+s3 = recreatable(lambda: boto3.client("s3", config=BOTO_CONFIG))
+
+ALLOWLIST_BUCKET = os.getenv("ALLOWLIST_SNAPSHOT_BUCKET", "")
+MANIFEST_KEY = os.getenv("ALLOWLIST_MANIFEST_KEY", "allowlist/manifest.json")
+COMPACT_EVERY = int(os.getenv("ALLOWLIST_COMPACT_EVERY", "50"))
+
+
+def snapshot_key(version):
+    return f"allowlist/snapshots/{version:012d}.bin"
+
+
+def delta_key(version):
+    return f"allowlist/deltas/{version:012d}.json"
+
+
+def get_json(s3_client, bucket, key):
+    response = call("s3", s3_client.get_object, Bucket=bucket, Key=key)
+    return json.loads(response["Body"].read())
+
+
+def put_json(s3_client, bucket, key, document):
+    call(
+        "s3",
+        s3_client.put_object,
+        Bucket=bucket,
+        Key=key,
+        Body=json.dumps(document, separators=(",", ":")).encode("utf-8"),
+        ContentType="application/json",
+    )
+
+
+def extract_changes(records):
+    """
+    Convierte los registros del stream en los sets de emails añadidos y
+    eliminados, respetando el orden de los eventos. Un MODIFY que cambia el
+    email da de baja el anterior (el stream debe incluir NEW_AND_OLD_IMAGES).
+    """
+    added, removed = set(), set()
+
+    def image_email(image):
+        email = (image or {}).get("email", {}).get("S")
+        return normalize_email(email) if email else None
+
+    for record in records:
+        event_name = record.get("eventName")
+        if event_name not in ("INSERT", "MODIFY", "REMOVE"):
+            continue
+        data = record.get("dynamodb", {})
+        old_email = image_email(data.get("OldImage"))
+        new_email = image_email(data.get("NewImage"))
+        if event_name == "REMOVE":
+            new_email = None
+        if old_email and old_email != new_email:
+            added.discard(old_email)
+            removed.add(old_email)
+        if new_email:
+            removed.discard(new_email)
+            added.add(new_email)
+    return added, removed
+
+
+def compact(s3_client, bucket, manifest, version):
+    """
+    Aplica los deltas pendientes sobre el último snapshot y sube un nuevo
+    snapshot para `version`.
+    """
+    response = call(
+        "s3", s3_client.get_object, Bucket=bucket, Key=manifest["snapshot_key"]
+    )
+    emails = set(AllowlistSnapshot(response["Body"].read()))
+    for v in range(manifest["snapshot_version"] + 1, version + 1):
+        delta = get_json(s3_client, bucket, delta_key(v))
+        emails.difference_update(delta["removed"])
+        emails.update(delta["added"])
+    key = snapshot_key(version)
+    call(
+        "s3", s3_client.put_object, Bucket=bucket, Key=key, Body=build_snapshot(emails)
+    )
+    logger.info(f"Snapshot de emails compactado en la versión {version}: {key}")
+    return key
+
+
+def stream_handler(event, context):
+    """
+    Lambda del stream de DynamoDB. Los errores se propagan para que el lote se
+    reintente (la función tiene concurrencia 1, así que las versiones no se
+    pisan).
+    """
+    added, removed = extract_changes(event.get("Records", []))
+    if not added and not removed:
+        return {"statusCode": 200, "body": "Sin cambios"}
+
+    manifest = get_json(s3, ALLOWLIST_BUCKET, MANIFEST_KEY)
+    version = manifest["version"] + 1
+    put_json(
+        s3,
+        ALLOWLIST_BUCKET,
+        delta_key(version),
+        {"version": version, "added": sorted(added), "removed": sorted(removed)},
+    )
+    if version - manifest["snapshot_version"] >= COMPACT_EVERY:
+        manifest["snapshot_key"] = compact(s3, ALLOWLIST_BUCKET, manifest, version)
+        manifest["snapshot_version"] = version
+    manifest["version"] = version
+    put_json(s3, ALLOWLIST_BUCKET, MANIFEST_KEY, manifest)
+    logger.info(
+        f"Delta de emails {version}: {len(added)} altas, {len(removed)} bajas"
+    )
+    return {"statusCode": 200, "body": f"Versión {version}"}
+
+
+class SyncedAllowlist:
+    """
+    Lista de emails válidos formada por el snapshot del manifest más los deltas
+    posteriores. refresh() consulta el manifest como mucho una vez cada
+    `refresh_seconds` y solo descarga lo que ha cambiado.
+    """
+
+    def __init__(self, s3_client, bucket, manifest_key, refresh_seconds=5):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.manifest_key = manifest_key
+        self.refresh_seconds = refresh_seconds
+        self.lock = threading.Lock()
+        self.checked_at = None
+        self.snapshot_version = -1
+        self.version = -1
+        # (snapshot, added, removed): se sustituye entero en cada refresh
+        self.state = (None, frozenset(), frozenset())
+
+    def refresh(self):
+        now = time.monotonic()
+        checked_at = self.checked_at
+        if checked_at is not None and now - checked_at < self.refresh_seconds:
+            return
+        with self.lock:
+            manifest = get_json(self.s3, self.bucket, self.manifest_key)
+            self.checked_at = now
+            if manifest["version"] == self.version:
+                return
+
+            snapshot, added, removed = self.state
+            snapshot_version = self.snapshot_version
+            added, removed = set(added), set(removed)
+            start = self.version + 1
+            if manifest["snapshot_version"] > snapshot_version:
+                response = call(
+                    "s3",
+                    self.s3.get_object,
+                    Bucket=self.bucket,
+                    Key=manifest["snapshot_key"],
+                )
+                snapshot = AllowlistSnapshot(response["Body"].read())
+                snapshot_version = manifest["snapshot_version"]
+                added, removed = set(), set()
+                start = snapshot_version + 1
+
+            for v in range(start, manifest["version"] + 1):
+                delta = get_json(self.s3, self.bucket, delta_key(v))
+                added.difference_update(delta["removed"])
+                removed.update(delta["removed"])
+                removed.difference_update(delta["added"])
+                added.update(delta["added"])
+
+            # Sustitución atómica del estado visible
+            self.state = (snapshot, frozenset(added), frozenset(removed))
+            self.snapshot_version = snapshot_version
+            self.version = manifest["version"]
+            logger.info(f"Lista de emails sincronizada en la versión {self.version}")
+
+    def __contains__(self, email):
+        snapshot, added, removed = self.state
+        if not isinstance(email, str) or snapshot is None:
+            return False
+        email = normalize_email(email)
+        if email in removed:
+            return False
+        if email in added:
+            return True
+        return email in snapshot
+
+
+def main():
+    from app import scan_valid_emails
+
+    parser = argparse.ArgumentParser(
+        description="Inicializa el snapshot versionado de emails válidos"
+    )
+    parser.add_argument("--bucket", required=True)
+    args = parser.parse_args()
+
+    key = snapshot_key(0)
+    payload = build_snapshot(scan_valid_emails())
+    call("s3", s3.put_object, Bucket=args.bucket, Key=key, Body=payload)
+    put_json(
+        s3,
+        args.bucket,
+        MANIFEST_KEY,
+        {"version": 0, "snapshot_version": 0, "snapshot_key": key},
+    )
+    print(f"Manifest inicializado en s3://{args.bucket}/{MANIFEST_KEY}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,35 @@
-import json
 import logging
 import os
+import random
+import time
+from collections import Counter
 from datetime import datetime
 from email_utils import (
     read_email_in_s3,
+    extract_sender,
     should_email_be_processed,
     send_queue_message,
+    send_queue_message_batch,
     move_email_to_no_relevante,
+    move_email_to_prefix,
+    parse_email_bytes,
 )
+from allowlist_snapshot import load_snapshot, normalize_email
+from allowlist_sync import SyncedAllowlist
+from routing import ForwardBatcher, Router, load_router
+from sender_limits import DynamoWindowCounter, SenderRateLimiter
+from metrics import emit_metric, emit_metrics
+from duplicates import DuplicateDetector, DynamoFingerprintIndex, LocalFingerprintIndex
+from threads import DynamoThreadIndex, LocalThreadIndex, resolve_thread
+from resilience import BOTO_CONFIG, call, reset_state
+from backpressure import BackpressureController
+from priority import LOW, URGENT, days_until_travel, priority_class
+from duplicates import simhash
+from snapstart import after_restore, before_snapshot, recreatable, recreate_clients
+from latency import hop_latencies
+from events import adapt_event
+from audit import load_audit_log
+from remote_config import ConfigProvider, load_config_source
 
 import boto3
 
@@ -15,105 +37,757 @@ import boto3
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Inicialización de clientes AWS
-sqs = boto3.client("sqs")
-s3 = boto3.client("s3")
+# Inicialización de clientes AWS (se recrean tras restaurar el snapshot)
+sqs = recreatable(lambda: boto3.client("sqs", config=BOTO_CONFIG))
+s3 = recreatable(lambda: boto3.client("s3", config=BOTO_CONFIG))
 
-dynamodb = boto3.resource("dynamodb", region_name="eu-west-1")
+dynamodb = recreatable(
+    lambda: boto3.resource("dynamodb", region_name="eu-west-1", config=BOTO_CONFIG)
+)
 
 # Obtener el nombre de la tabla desde una variable de entorno o usar el valor por defecto
 email_table_name = os.getenv(
     "DYNAMO_EMAIL_TABLE", "tripilot-test-booking-agent-email-booking"
 )
-email_table = dynamodb.Table(email_table_name)
+email_table = recreatable(lambda: dynamodb.Table(email_table_name))
 EMAIL_VAL = set()
+# Última lista de emails cargada correctamente desde DynamoDB
+LAST_VALID_EMAILS = None
+# Qué hacer si la lista de emails no está disponible: "forward" envía el email
+# al agente marcado con allowlist_unavailable; "retry" lo deja fallar para que
+# SQS lo reintente (o lo mande a la DLQ). Nunca se descarta.
+FAILSAFE_POLICY = os.getenv("FAILSAFE_POLICY", "forward")
+
+# Snapshot opcional de la lista de emails en S3 (ver allowlist_snapshot.py)
+ALLOWLIST_SNAPSHOT_BUCKET = os.getenv("ALLOWLIST_SNAPSHOT_BUCKET", "")
+ALLOWLIST_SNAPSHOT_KEY = os.getenv("ALLOWLIST_SNAPSHOT_KEY", "")
+ALLOWLIST_SNAPSHOT = None
+
+# Sincronización incremental por deltas (ver allowlist_sync.py)
+ALLOWLIST_MANIFEST_KEY = os.getenv("ALLOWLIST_MANIFEST_KEY", "")
+ALLOWLIST_REFRESH_SECONDS = float(os.getenv("ALLOWLIST_REFRESH_SECONDS", "5"))
+SYNCED_ALLOWLIST = None
+
+# Tabla de rutas hacia las colas del agente (ver routing.py)
+ROUTING_CONFIG_PATH = os.getenv(
+    "ROUTING_CONFIG_PATH", os.path.join(os.path.dirname(__file__), "routing.json")
+)
+ROUTER = load_router(ROUTING_CONFIG_PATH, os.environ.get("SQS_URL"))
+
+# Límite de emails por remitente hacia el agente (ver sender_limits.py)
+sender_limit_table_name = os.getenv("SENDER_LIMIT_TABLE", "")
+SENDER_LIMITER = SenderRateLimiter(
+    float(os.getenv("SENDER_LIMIT_PER_MINUTE", "60")),
+    (
+        DynamoWindowCounter(
+            recreatable(lambda: dynamodb.Table(sender_limit_table_name))
+        )
+        if sender_limit_table_name
+        else None
+    ),
+)
+# Carpeta donde se retienen los emails que superan el límite
+HOLDING_PREFIX = "retenidos/"
+
+# Detección de casi duplicados por referencia de reserva (ver duplicates.py)
+duplicate_table_name = os.getenv("DUPLICATE_TABLE", "")
+duplicate_ttl_seconds = int(os.getenv("DUPLICATE_TTL_SECONDS", str(14 * 24 * 3600)))
+DUPLICATE_DETECTOR = DuplicateDetector(
+    (
+        DynamoFingerprintIndex(
+            recreatable(lambda: dynamodb.Table(duplicate_table_name)),
+            duplicate_ttl_seconds,
+        )
+        if duplicate_table_name
+        else LocalFingerprintIndex(duplicate_ttl_seconds)
+    ),
+    int(os.getenv("DUPLICATE_MAX_DISTANCE", "3")),
+)
+# "flag" marca el mensaje para el agente; "suppress" lo mueve a DUPLICATE_PREFIX
+DUPLICATE_ACTION = os.getenv("DUPLICATE_ACTION", "flag")
+DUPLICATE_PREFIX = "duplicados/"
+
+# Índice de conversaciones (ver threads.py)
+thread_table_name = os.getenv("THREAD_TABLE", "")
+thread_ttl_seconds = int(os.getenv("THREAD_TTL_SECONDS", str(90 * 24 * 3600)))
+THREAD_INDEX = (
+    DynamoThreadIndex(
+        recreatable(lambda: dynamodb.Table(thread_table_name)), thread_ttl_seconds
+    )
+    if thread_table_name
+    else LocalThreadIndex(thread_ttl_seconds)
+)
+
+# Backpressure hacia el agente (ver backpressure.py). Los emails cuya
+# actividad es en menos de BACKPRESSURE_PRIORITY_DAYS días (o sin fecha)
+# nunca se difieren.
+BACKPRESSURE = BackpressureController(
+    sqs,
+    int(os.getenv("BACKPRESSURE_THRESHOLD", "0")),
+    os.getenv("DEFERRED_SQS_URL", ""),
+    float(os.getenv("BACKPRESSURE_SAMPLE_SECONDS", "30")),
+)
+BACKPRESSURE_PRIORITY_DAYS = int(os.getenv("BACKPRESSURE_PRIORITY_DAYS", "0"))
+
+# Carriles de prioridad por fecha de la actividad (ver priority.py): los
+# urgentes que van a la cola por defecto se envían a URGENT_SQS_URL y los de
+# baja prioridad se entregan con LOW_PRIORITY_DELAY_SECONDS de retraso
+URGENT_SQS_URL = os.getenv("URGENT_SQS_URL", "")
+URGENT_DAYS = int(os.getenv("URGENT_DAYS", "1"))
+LOW_PRIORITY_DAYS = int(os.getenv("LOW_PRIORITY_DAYS", "30"))
+LOW_PRIORITY_DELAY_SECONDS = int(os.getenv("LOW_PRIORITY_DELAY_SECONDS", "0"))
+
+# Registro de auditoría de decisiones (ver audit.py)
+AUDIT_LOG = load_audit_log(
+    s3,
+    os.getenv("AUDIT_BUCKET", ""),
+    os.getenv("AUDIT_LOCAL_DIR", ""),
+    os.getenv("AUDIT_PREFIX", "audit/"),
+)
+
+# Valores por defecto (variables de entorno) de los ajustes que se pueden
+# cambiar con la configuración remota
+DEFAULT_SETTINGS = {
+    "sqs_url": os.environ.get("SQS_URL"),
+    "email_table": email_table_name,
+    "failsafe_policy": FAILSAFE_POLICY,
+    "sender_limit_per_minute": SENDER_LIMITER.limit_per_minute,
+    "duplicate_action": DUPLICATE_ACTION,
+    "duplicate_max_distance": DUPLICATE_DETECTOR.max_distance,
+    "backpressure_threshold": BACKPRESSURE.threshold,
+    "backpressure_priority_days": BACKPRESSURE_PRIORITY_DAYS,
+    "urgent_sqs_url": URGENT_SQS_URL,
+    "urgent_days": URGENT_DAYS,
+    "low_priority_days": LOW_PRIORITY_DAYS,
+    "low_priority_delay_seconds": LOW_PRIORITY_DELAY_SECONDS,
+}
+
+
+class TriageRules:
+    """
+    Reglas y umbrales vigentes. Se construyen enteras a partir de cada
+    versión de la configuración remota y se sustituyen de una vez en RULES.
+    """
+
+    def __init__(self, settings, router, version=None):
+        self.version = version
+        self.router = router
+        self.email_table = (
+            email_table
+            if settings["email_table"] == email_table_name
+            else dynamodb.Table(settings["email_table"])
+        )
+        self.failsafe_policy = settings["failsafe_policy"]
+        self.sender_limit_per_minute = float(settings["sender_limit_per_minute"])
+        self.duplicate_action = settings["duplicate_action"]
+        self.duplicate_max_distance = int(settings["duplicate_max_distance"])
+        self.backpressure_threshold = int(settings["backpressure_threshold"])
+        self.backpressure_priority_days = int(settings["backpressure_priority_days"])
+        self.urgent_sqs_url = settings["urgent_sqs_url"]
+        self.urgent_days = int(settings["urgent_days"])
+        self.low_priority_days = int(settings["low_priority_days"])
+        # Máximo de DelaySeconds en SQS: 15 minutos
+        self.low_priority_delay_seconds = min(
+            int(settings["low_priority_delay_seconds"]), 900
+        )
+
+
+def compile_rules(document):
+    """
+    Construye las reglas de un documento de configuración remota: sus
+    `settings` sobre los valores por defecto y su tabla de rutas (o la de
+    ROUTING_CONFIG_PATH si no trae `routing`).
+    """
+    settings = {**DEFAULT_SETTINGS, **document.get("settings", {})}
+    for name, allowed in (
+        ("failsafe_policy", ("forward", "retry")),
+        ("duplicate_action", ("flag", "suppress")),
+    ):
+        if settings[name] not in allowed:
+            raise ValueError(f"Valor no válido para {name}: {settings[name]}")
+    if "routing" in document:
+        router = Router(document["routing"], settings["sqs_url"])
+    else:
+        router = load_router(ROUTING_CONFIG_PATH, settings["sqs_url"])
+    return TriageRules(settings, router, document.get("version"))
+
+
+RULES = TriageRules(DEFAULT_SETTINGS, ROUTER)
+config_source = load_config_source(os.getenv("CONFIG_SOURCE", ""), s3)
+CONFIG_PROVIDER = (
+    ConfigProvider(
+        config_source,
+        compile_rules,
+        float(os.getenv("CONFIG_TTL_SECONDS", "60")),
+    )
+    if config_source
+    else None
+)
+
+
+def refresh_rules(force=False):
+    """
+    Comprueba la configuración remota (como mucho una vez cada
+    CONFIG_TTL_SECONDS) y, si hay una versión nueva, sustituye RULES y
+    actualiza los umbrales de los limitadores, que conservan su estado.
+    Se llama una vez por lote, no por email.
+    """
+    global RULES
+    if CONFIG_PROVIDER is None:
+        return
+    rules = CONFIG_PROVIDER.refresh(force)
+    if rules is None or rules is RULES:
+        return
+    if rules.sender_limit_per_minute != SENDER_LIMITER.limit_per_minute:
+        SENDER_LIMITER.limit_per_minute = rules.sender_limit_per_minute
+        with SENDER_LIMITER.lock:
+            SENDER_LIMITER.buckets.clear()
+    DUPLICATE_DETECTOR.max_distance = rules.duplicate_max_distance
+    BACKPRESSURE.threshold = rules.backpressure_threshold
+    RULES = rules
+
+
+# Métrica de cada tramo de latency.hop_latencies
+METRIC_BY_HOP = {
+    "ses_to_queue": "SesToQueueLatency",
+    "queue_wait": "QueueWaitLatency",
+    "handling": "HandlingLatency",
+}
+
+# Resultados posibles de process_email
+FORWARDED = "forwarded"
+DISCARDED = "discarded"
+FAILED = "failed"
+THROTTLED = "throttled"
+DUPLICATE = "duplicate"
+
+
+def scan_valid_emails():
+    """
+    Recorre la tabla de DynamoDB y devuelve el set de emails válidos.
+    """
+    table = RULES.email_table
+    response = call("dynamodb", table.scan)
+    items = response.get("Items", [])
+    while "LastEvaluatedKey" in response:
+        response = call(
+            "dynamodb",
+            table.scan,
+            ExclusiveStartKey=response["LastEvaluatedKey"],
+        )
+        items.extend(response.get("Items", []))
+    # Misma normalización que los snapshots y los deltas (allowlist_snapshot.py)
+    return set(normalize_email(item["email"]) for item in items if "email" in item)
 
 
 def load_valid_emails():
+    """
+    Devuelve los emails válidos. Con ALLOWLIST_MANIFEST_KEY se usa la lista
+    sincronizada por deltas; si hay un snapshot configurado se carga una sola
+    vez por contenedor; si no, se escanea la tabla de DynamoDB.
+    Si DynamoDB falla se usa la última lista cargada y, si no hay ninguna,
+    devuelve None (lista no disponible).
+    """
+    global ALLOWLIST_SNAPSHOT, SYNCED_ALLOWLIST, LAST_VALID_EMAILS
+    if ALLOWLIST_MANIFEST_KEY:
+        if SYNCED_ALLOWLIST is None:
+            SYNCED_ALLOWLIST = SyncedAllowlist(
+                s3,
+                ALLOWLIST_SNAPSHOT_BUCKET,
+                ALLOWLIST_MANIFEST_KEY,
+                ALLOWLIST_REFRESH_SECONDS,
+            )
+        try:
+            SYNCED_ALLOWLIST.refresh()
+        except Exception as e:
+            logger.error(f"Error al sincronizar la lista de emails: {e}")
+        if SYNCED_ALLOWLIST.version >= 0:
+            return SYNCED_ALLOWLIST
+
+    if ALLOWLIST_SNAPSHOT_KEY:
+        if ALLOWLIST_SNAPSHOT is None:
+            try:
+                ALLOWLIST_SNAPSHOT = load_snapshot(
+                    s3, ALLOWLIST_SNAPSHOT_BUCKET, ALLOWLIST_SNAPSHOT_KEY
+                )
+            except Exception as e:
+                logger.error(f"Error al cargar el snapshot de emails: {e}")
+        if ALLOWLIST_SNAPSHOT is not None:
+            return ALLOWLIST_SNAPSHOT
+
     EMAIL_VAL = set()
     try:
-        response = email_table.scan()
-        items = response.get("Items", [])
-        while "LastEvaluatedKey" in response:
-            response = email_table.scan(ExclusiveStartKey=response["LastEvaluatedKey"])
-            items.extend(response.get("Items", []))
-        EMAIL_VAL = set(item["email"] for item in items if "email" in item)
+        EMAIL_VAL = scan_valid_emails()
+        LAST_VALID_EMAILS = EMAIL_VAL
         logger.info(f"Lista de emails cargados desde DynamoDB: {EMAIL_VAL}")
     except Exception as e:
         logger.error(f"Error al cargar emails desde DynamoDB: {e}")
+        if LAST_VALID_EMAILS is not None:
+            logger.warning("Se usa la última lista de emails cargada")
+            return LAST_VALID_EMAILS
+        return None
     return EMAIL_VAL
 
 
-def lambda_handler(event, context):
+def build_combined_email(email_content):
     """
-    Función principal Lambda que procesa los emails recibidos a través de SQS.
+    Construye el texto combinado (From, To, Subject, Body y fecha_reserva)
+    que se envía al agente a partir del email leído de S3.
     """
-    EMAIL_VAL = load_valid_emails()
+    # Extraer headers y cuerpo
+    headers = email_content["headers"]
+    body = email_content["body"]
 
-    for record in event.get("Records", []):
-        message = json.loads(record.get("body", "{}"))
-        action_info = message.get("receipt", {}).get("action", {})
-        s3_bucket = action_info.get("bucketName")
-        s3_object = action_info.get("objectKey")
+    # Convertir las listas de direcciones en cadenas legibles.
+    from_emails = ", ".join(
+        [f"{name} <{email}>" if name else email for name, email in headers["from"]]
+    )
+    to_emails = ", ".join(
+        [f"{name} <{email}>" if name else email for name, email in headers["to"]]
+    )
+    subject = headers["subject"]
 
-        if not s3_bucket or not s3_object:
-            logger.error("Falta el bucket o la clave del objeto en el mensaje SQS")
-            continue
+    # Seleccionar el cuerpo: se prefiere el texto plano; si no existe, se usa el HTML.
+    email_body = body["plain"] if body["plain"] else body["html"]
 
-        email_content = read_email_in_s3(s3_bucket, s3_object)
-        logger.info(f"Email content: {email_content}")
+    fecha_reserva = datetime.today().strftime("%d-%m-%Y")
+    # Crear el email combinado con el formato solicitado.
+    combined_email = (
+        f"From: {from_emails}\n"
+        f"To: {to_emails}\n"
+        f"Subject: {subject}\n"
+        f"Body: {email_body}\n"
+        f"fecha_reserva: {fecha_reserva}"
+    )
+    # Los adjuntos (ya subidos a S3) se referencian al final
+    attachments = email_content.get("attachments") or []
+    if attachments:
+        combined_email += "\nAttachments: " + ", ".join(
+            f"{a['filename'] or a['content_type']} <{a['key']}>" for a in attachments
+        )
+    return combined_email
 
-        if not email_content:
-            logger.warning("No se pudo cargar el email desde S3.")
-            continue
 
-        # Extraer headers y cuerpo
-        headers = email_content["headers"]
-        body = email_content["body"]
+def process_email(
+    s3_bucket,
+    s3_object,
+    valid_emails,
+    rate_limiter=None,
+    batcher=None,
+    use_parsed_cache=True,
+    record_id=None,
+    ses_receipt=None,
+    audit=None,
+    sender_limit=True,
+):
+    """
+    Decide si un email almacenado en S3 debe ser procesado por el agente y,
+    en ese caso, lo envía a sus colas SQS según la tabla de rutas; si no, lo
+    mueve a no_relevante. Con `batcher` los envíos se acumulan para hacerlos
+    por lotes. Se usa tanto desde lambda_handler como desde las herramientas
+    de backfill; `use_parsed_cache` reutiliza el email ya parseado en un
+    intento anterior.
+    Los emails de remitentes que superan su límite se retienen en
+    HOLDING_PREFIX (salvo con `sender_limit` False, para las herramientas de
+    operación, que ya limitan su propio ritmo) y los casi duplicados de una
+    reserva ya enviada se marcan o se suprimen según DUPLICATE_ACTION. Con
+    `valid_emails` None (lista no disponible) se aplica FAILSAFE_POLICY.
+    `ses_receipt` (message id de SES, momento de recepción) se propaga como
+    atributos del mensaje al agente.
+    Si se pasa el dict `audit` se rellena con el detalle de la decisión
+    (motivo, regla, tamaños) para el registro de auditoría.
+    Devuelve FORWARDED, DISCARDED, THROTTLED, DUPLICATE o FAILED.
+    """
+    audit = {} if audit is None else audit
+    rules = RULES
+    start = time.perf_counter()
+    email_content = read_email_in_s3(s3_bucket, s3_object, use_parsed_cache)
+    audit["read_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    logger.info(f"Email content: {email_content}")
 
-        # Convertir las listas de direcciones en cadenas legibles.
-        from_emails = ", ".join(
-            [f"{name} <{email}>" if name else email for name, email in headers["from"]]
-        )
-        to_emails = ", ".join(
-            [f"{name} <{email}>" if name else email for name, email in headers["to"]]
+    if not email_content:
+        logger.warning("No se pudo cargar el email desde S3.")
+        audit["reason"] = "read_failed"
+        return FAILED
+
+    combined_email = build_combined_email(email_content)
+    attachments = email_content.get("attachments", [])
+    audit.update(
+        body_chars=sum(len(part) for part in email_content["body"].values()),
+        attachments=len(attachments),
+        attachment_bytes=sum(a.get("size", 0) for a in attachments),
+    )
+
+    logger.info("----- Email Combinado -----")
+    logger.info(combined_email)
+
+    allowlist_unavailable = valid_emails is None
+    if allowlist_unavailable:
+        if rules.failsafe_policy != "forward":
+            logger.error("Lista de emails no disponible; el email se reintentará")
+            audit["reason"] = "allowlist_unavailable"
+            return FAILED
+        logger.warning("Lista de emails no disponible; se envía al agente")
+        relevant = True
+    else:
+        relevant = should_email_be_processed(combined_email, valid_emails)
+
+    sender = extract_sender(combined_email)
+    audit["sender"] = sender
+    if relevant:
+        audit["reason"] = "failsafe" if allowlist_unavailable else "allowlist"
+        if sender_limit and not SENDER_LIMITER.allow(sender):
+            logger.warning(
+                f"Límite de envíos superado para {sender}; retenido en {HOLDING_PREFIX}"
+            )
+            move_email_to_prefix(s3_bucket, s3_object, HOLDING_PREFIX)
+            audit["reason"] = "sender_limit"
+            return THROTTLED
+
+        msg_attributes = {"email": {"DataType": "String", "StringValue": "email"}}
+        if allowlist_unavailable:
+            msg_attributes["allowlist_unavailable"] = {
+                "DataType": "String",
+                "StringValue": "true",
+            }
+        ses_message_id, receipt_time = ses_receipt or (None, None)
+        # Un reintento o backfill del mismo email no es duplicado de sí mismo
+        email_id = ses_message_id or s3_object.rpartition("/")[2]
+        # Sin la línea fecha_reserva, que cambia cada día
+        reference, duplicate, fingerprint = DUPLICATE_DETECTOR.check(
+            combined_email.rpartition("\nfecha_reserva:")[0], email_id
         )
-        subject = headers["subject"]
-
-        # Seleccionar el cuerpo: se prefiere el texto plano; si no existe, se usa el HTML.
-        email_body = body["plain"] if body["plain"] else body["html"]
-
-        fecha_reserva = datetime.today().strftime("%d-%m-%Y")
-        # Crear el email combinado con el formato solicitado.
-        combined_email = (
-            f"From: {from_emails}\n"
-            f"To: {to_emails}\n"
-            f"Subject: {subject}\n"
-            f"Body: {email_body}\n"
-            f"fecha_reserva: {fecha_reserva}"
+        audit.update(
+            booking_reference=reference,
+            near_duplicate=duplicate,
+            email_id=email_id,
+            fingerprint=None if fingerprint is None else format(fingerprint, "016x"),
         )
+        if reference:
+            msg_attributes["booking_reference"] = {
+                "DataType": "String",
+                "StringValue": reference,
+            }
+        if email_content.get("parsed_key"):
+            msg_attributes["parsed_key"] = {
+                "DataType": "String",
+                "StringValue": email_content["parsed_key"],
+            }
+        thread_id, is_reply = resolve_thread(email_content["headers"], THREAD_INDEX)
+        audit["thread_id"] = thread_id
+        if thread_id:
+            msg_attributes["thread_id"] = {
+                "DataType": "String",
+                "StringValue": thread_id,
+            }
+            msg_attributes["is_reply"] = {
+                "DataType": "String",
+                "StringValue": "true" if is_reply else "false",
+            }
+        if ses_message_id:
+            msg_attributes["ses_message_id"] = {
+                "DataType": "String",
+                "StringValue": ses_message_id,
+            }
+        if receipt_time:
+            msg_attributes["ses_receipt_time"] = {
+                "DataType": "String",
+                "StringValue": receipt_time,
+            }
+        if duplicate:
+            logger.info(f"Email casi duplicado de la reserva {reference}")
+            if rules.duplicate_action == "suppress":
+                move_email_to_prefix(s3_bucket, s3_object, DUPLICATE_PREFIX)
+                audit["reason"] = "near_duplicate"
+                return DUPLICATE
+            msg_attributes["near_duplicate"] = {
+                "DataType": "String",
+                "StringValue": "true",
+            }
 
+        queue_urls, audit["rule"] = rules.router.match(
+            email_content["headers"], combined_email
+        )
+        days = days_until_travel(combined_email)
+        priority = priority_class(days, rules.urgent_days, rules.low_priority_days)
+        audit.update(days_until_travel=days, priority=priority)
+        if priority == URGENT and rules.urgent_sqs_url:
+            queue_urls = [
+                rules.urgent_sqs_url if q == rules.router.default_queue_url else q
+                for q in queue_urls
+            ]
+        delay_seconds = rules.low_priority_delay_seconds if priority == LOW else 0
+        if BACKPRESSURE.enabled:
+            high_priority = (
+                days is None
+                or days <= rules.backpressure_priority_days
+                or priority == URGENT
+            )
+            queue_urls, deferred = BACKPRESSURE.route(queue_urls, high_priority)
+            audit["deferred"] = bool(deferred)
+            if deferred:
+                emit_metric("DeferredEmails", deferred)
+                logger.info(
+                    f"Cola del agente saturada; email diferido (viaje en {days} días)"
+                )
+        logger.info(f"Preparando mensaje para enviar a las colas SQS: {queue_urls}")
+        audit["queues"] = len(queue_urls)
 
-        logger.info("----- Email Combinado -----")
-        logger.info(combined_email)
-
-        if should_email_be_processed(combined_email, EMAIL_VAL):
-            queue_url = os.environ.get("SQS_URL")
-            logger.info("Preparando mensaje para enviar a la cola SQS")
+        if batcher is not None:
+            for queue_url in queue_urls:
+                batcher.add(
+                    queue_url, msg_attributes, combined_email, record_id, delay_seconds
+                )
+            return FORWARDED
 
+        result = FORWARDED
+        for queue_url in queue_urls:
+            if rate_limiter is not None:
+                rate_limiter.acquire()
             try:
                 response = send_queue_message(
-                    queue_url,
-                    {"email": {"DataType": "String", "StringValue": "email"}},
-                    combined_email,
+                    queue_url, msg_attributes, combined_email, delay_seconds
                 )
                 logger.info(
                     f"Mensaje enviado a Queue con ID: {response.get('MessageId')}"
                 )
             except Exception:
                 logger.exception("Exception sending the message")
+                result = FAILED
+        if result == FORWARDED:
+            remember_fingerprint(audit)
+        return result
+    else:
+        logger.info("El email no será procesado; moviendo a carpeta no_relevante")
+        audit["reason"] = "not_in_allowlist"
+        move_email_to_no_relevante(s3_bucket, s3_object)
+        return DISCARDED
+
+
+def process_and_audit(source, s3_bucket, s3_object, valid_emails, rate_limiter, **kw):
+    """
+    process_email para las herramientas de operación (backfill, redrive,
+    liberación de retenidos): añade la decisión al registro de auditoría con
+    `source` como origen, igual que process_record en el triaje. Quien llama
+    hace AUDIT_LOG.flush() tras cada lote.
+    """
+    audit = {"source": source, "bucket": s3_bucket, "key": s3_object}
+    try:
+        audit["result"] = process_email(
+            s3_bucket, s3_object, valid_emails, rate_limiter, audit=audit, **kw
+        )
+    except Exception as e:
+        audit.update(result=FAILED, error=type(e).__name__)
+        raise
+    finally:
+        if AUDIT_LOG is not None:
+            AUDIT_LOG.add(audit)
+    return audit["result"]
+
+
+def remember_fingerprint(audit):
+    """
+    Guarda la huella de duplicados de un email ya enviado al agente; solo
+    entonces cuenta para detectar los siguientes (ver duplicates.py).
+    """
+    if audit.get("fingerprint") and not audit.get("near_duplicate"):
+        DUPLICATE_DETECTOR.remember(
+            audit["booking_reference"],
+            int(audit["fingerprint"], 16),
+            audit.get("email_id"),
+        )
+
+
+# Email mínimo para recorrer el camino de decisión antes del snapshot
+WARM_UP_EMAIL = (
+    b"From: Warm Up <warmup@example.com>\r\n"
+    b"To: reservas@example.com\r\n"
+    b"Subject: Booking confirmation\r\n"
+    b"MIME-Version: 1.0\r\n"
+    b"Content-Type: text/plain; charset=utf-8\r\n"
+    b"\r\n"
+    b"Travel date: 1 January 2030\r\n"
+)
+
+
+@before_snapshot
+def warm_up():
+    """
+    Antes del snapshot de SnapStart: carga la lista de emails y ejecuta una
+    vez el parseo y la decisión para que imports, regex y zonas horarias
+    queden en memoria.
+    """
+    refresh_rules(force=True)
+    load_valid_emails()
+    email_content = parse_email_bytes(WARM_UP_EMAIL)
+    combined_email = build_combined_email(email_content)
+    should_email_be_processed(combined_email, set())
+    days_until_travel(combined_email)
+    simhash(combined_email)
+    RULES.router.route(email_content["headers"], combined_email)
+
+
+@after_restore
+def refresh_after_restore():
+    """
+    Tras restaurar el snapshot: vuelve a crear todos los clientes de boto3
+    (los de este módulo, email_utils, compaction, allowlist_sync y el de SSM
+    de la configuración remota), da una semilla propia al generador
+    aleatorio de este contenedor y vuelve a cargar la configuración remota
+    (compilándola de nuevo, porque sus tablas son de los clientes anteriores)
+    y la lista de emails.
+    """
+    global ALLOWLIST_SNAPSHOT
+    recreate_clients()
+    random.seed()
+    reset_state()
+    BACKPRESSURE.samples.clear()
+    if SYNCED_ALLOWLIST is not None:
+        SYNCED_ALLOWLIST.checked_at = None
+    ALLOWLIST_SNAPSHOT = None
+    if CONFIG_PROVIDER is not None:
+        CONFIG_PROVIDER.etag = CONFIG_PROVIDER.digest = None
+    refresh_rules(force=True)
+    load_valid_emails()
+
+
+def process_record(record, valid_emails, batcher, audit=None):
+    """
+    Procesa un TriageRecord (ver events.py) y devuelve el resultado de
+    process_email, o None si el registro no trae ubicación en S3.
+    `audit` se rellena con el registro de auditoría del email.
+    """
+    audit = {} if audit is None else audit
+    audit.update(
+        message_id=record.record_id,
+        ses_message_id=record.ses_message_id,
+        source=record.source,
+        bucket=record.bucket,
+        key=record.key,
+    )
+
+    if not record.bucket or not record.key:
+        logger.error("Falta el bucket o la clave del objeto en el evento")
+        audit["reason"] = "missing_s3_location"
+        return None
+
+    start = time.perf_counter()
+    try:
+        result = process_email(
+            record.bucket,
+            record.key,
+            valid_emails,
+            batcher=batcher,
+            # En el primer intento no hay email parseado que reutilizar
+            use_parsed_cache=record.receive_count > 1,
+            record_id=record.record_id,
+            ses_receipt=(record.ses_message_id, record.receipt_time),
+            audit=audit,
+        )
+    except Exception as e:
+        audit.update(result=FAILED, error=type(e).__name__)
+        raise
+    finally:
+        audit["total_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    audit["result"] = result
+    return result
+
+
+def emit_latency(record, forwarded_at):
+    """
+    Emite la latencia desde la recepción en SES hasta el envío al agente y
+    su desglose por tramos (ver latency.py), con el origen del evento como
+    dimensión para comparar topologías.
+    """
+    latencies = hop_latencies(record.receipt_time, record.sqs_attributes, forwarded_at)
+    if not latencies:
+        return
+    values = {"ReceiptToForwardLatency": latencies.pop("total")}
+    values.update((METRIC_BY_HOP[hop], ms) for hop, ms in latencies.items())
+    emit_metrics(
+        values,
+        unit="Milliseconds",
+        dimensions={"Source": record.source},
+        ses_message_id=record.ses_message_id,
+    )
+
+
+def process_records(records, executor=None):
+    """
+    Procesa una lista de TriageRecord y devuelve los record_id que han
+    fallado (no procesados o no enviados). Con `executor` los registros se
+    procesan en paralelo.
+    """
+    refresh_rules()
+    EMAIL_VAL = load_valid_emails()
+    batcher = ForwardBatcher(send_queue_message_batch)
+    results = Counter()
+    failures = []
+    audits = [{} for _ in records]
+
+    try:
+        if executor is None:
+            outcomes = [
+                process_record(record, EMAIL_VAL, batcher, audit)
+                for record, audit in zip(records, audits)
+            ]
         else:
-            logger.info("El email no será procesado; moviendo a carpeta no_relevante")
-            move_email_to_no_relevante(s3_bucket, s3_object)
+            outcomes = list(
+                executor.map(
+                    lambda r, a: process_record(r, EMAIL_VAL, batcher, a),
+                    records,
+                    audits,
+                )
+            )
+    finally:
+        if AUDIT_LOG is not None:
+            for audit in audits:
+                if audit:
+                    AUDIT_LOG.add(audit)
+    for record, result in zip(records, outcomes):
+        results[result] += 1
+        if result == FAILED:
+            failures.append(record.record_id)
+
+    failed = batcher.flush()
+    if failed:
+        logger.error(f"{len(failed)} mensajes no se pudieron enviar a SQS")
+        failures.extend(failed)
+    forwarded_at = int(time.time() * 1000)
+    for record, result, audit in zip(records, outcomes, audits):
+        if result != FORWARDED:
+            continue
+        if record.record_id in failed:
+            audit.update(result=FAILED, error="send_failed")
+        else:
+            remember_fingerprint(audit)
+            emit_latency(record, forwarded_at)
+    if AUDIT_LOG is not None:
+        AUDIT_LOG.flush()
+    if results[THROTTLED]:
+        emit_metric("ThrottledEmails", results[THROTTLED])
+    if results[DUPLICATE]:
+        emit_metric("SuppressedDuplicateEmails", results[DUPLICATE])
+    return [message_id for message_id in dict.fromkeys(failures) if message_id]
+
+
+def lambda_handler(event, context):
+    """
+    Función principal Lambda. Acepta mensajes SQS (topología desplegada),
+    notificaciones de S3, la acción Lambda de SES y eventos de EventBridge
+    (ver events.py).
+    Con SQS, los mensajes que no se han podido procesar o enviar se devuelven
+    en batchItemFailures para que SQS los reintente (o los lleve a la DLQ);
+    con el resto de orígenes (invocación asíncrona) se lanza una excepción
+    para que Lambda reintente el evento.
+    """
+    source, records = adapt_event(event)
+    failures = process_records(records)
 
-    return {"statusCode": 200, "body": "Mensaje procesado"}
+    if source != "sqs" and failures:
+        raise RuntimeError(f"No se han podido triar {len(failures)} emails")
+    return {
+        "statusCode": 200,
+        "body": "Mensaje procesado",
+        "batchItemFailures": [{"itemIdentifier": m} for m in failures],
+    }
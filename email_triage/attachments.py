@@ -0,0 +1,205 @@
+"""
+Extracción de adjuntos en streaming.
+
+Recorre el email MIME línea a línea mientras se descarga de S3. Las partes que
+no son texto (PDF de vouchers, imágenes...) se decodifican y se suben a S3
+sobre la marcha, con multipart upload si son grandes, sin tenerlas enteras en
+memoria. El resto (cabeceras, text/plain y text/html) se copia a un "esqueleto"
+del email que se parsea después como siempre. Así la memoria usada depende
+del texto del email y no del tamaño de los adjuntos.
+"""
+import binascii
+import logging
+import re
+from email import policy
+from email.parser import BytesHeaderParser
+
+from compaction import BundleWriter
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+ATTACHMENTS_PREFIX = "attachments/"
+READ_CHUNK_SIZE = 64 * 1024
+# Líneas más largas se procesan por trozos (nunca pueden ser un boundary)
+MAX_LINE = 1024 * 1024
+INLINE_TYPES = ("text/plain", "text/html")
+SAFE_FILENAME = re.compile(r"[^A-Za-z0-9._-]+")
+
+header_parser = BytesHeaderParser(policy=policy.compat32)
+
+
+def iter_lines(body):
+    """
+    Devuelve las líneas (con su fin de línea) de un stream con read().
+    """
+    pending = b""
+    for chunk in iter(lambda: body.read(READ_CHUNK_SIZE), b""):
+        pending += chunk
+        start = 0
+        while True:
+            end = pending.find(b"\n", start)
+            if end < 0:
+                break
+            yield pending[start : end + 1]
+            start = end + 1
+        pending = pending[start:]
+        if len(pending) > MAX_LINE:
+            yield pending
+            pending = b""
+    if pending:
+        yield pending
+
+
+class PartDecoder:
+    """
+    Decodifica el Content-Transfer-Encoding de una parte de forma incremental.
+    """
+
+    def __init__(self, encoding):
+        self.encoding = (encoding or "7bit").strip().lower()
+        self.pending = b""
+
+    def feed(self, line):
+        if self.encoding == "base64":
+            data = self.pending + line.translate(None, b" \t\r\n")
+            usable = len(data) // 4 * 4
+            self.pending = data[usable:]
+            return binascii.a2b_base64(data[:usable]) if usable else b""
+        if self.encoding == "quoted-printable":
+            return binascii.a2b_qp(line)
+        return line
+
+    def close(self):
+        if self.encoding == "base64" and self.pending:
+            data = self.pending + b"=" * (-len(self.pending) % 4)
+            self.pending = b""
+            try:
+                return binascii.a2b_base64(data)
+            except binascii.Error:
+                return b""
+        return b""
+
+
+class AttachmentUpload:
+    """
+    Adjunto en curso: decodifica cada línea y la escribe en S3.
+    """
+
+    def __init__(self, bucket, key, headers):
+        self.key = key
+        self.filename = headers.get_filename() or ""
+        self.content_type = headers.get_content_type()
+        self.decoder = PartDecoder(headers.get("Content-Transfer-Encoding"))
+        self.writer = BundleWriter(bucket, key)
+        self.size = 0
+
+    def feed(self, line):
+        data = self.decoder.feed(line)
+        if data:
+            self.writer.write(data)
+            self.size += len(data)
+
+    def close(self):
+        data = self.decoder.close()
+        if data:
+            self.writer.write(data)
+            self.size += len(data)
+        self.writer.close()
+        return {
+            "key": self.key,
+            "filename": self.filename,
+            "content_type": self.content_type,
+            "size": self.size,
+        }
+
+
+def should_offload(headers):
+    """
+    Se suben a S3 todas las partes hoja salvo text/plain y text/html, que son
+    las que usa extract_email_body.
+    """
+    maintype = headers.get_content_maintype()
+    if maintype in ("multipart", "message"):
+        return False
+    return headers.get_content_type() not in INLINE_TYPES
+
+
+def offload_attachments(body, bucket, prefix):
+    """
+    Lee el email desde `body` (stream con read()), sube los adjuntos bajo
+    `prefix` y devuelve (esqueleto del email en bytes, lista de adjuntos).
+    """
+    skeleton = bytearray()
+    attachments = []
+    boundaries = []
+    header_lines = []
+    in_headers = True
+    upload = None
+
+    def finish_upload():
+        nonlocal upload
+        if upload is not None:
+            attachments.append(upload.close())
+            upload = None
+
+    try:
+        for line in iter_lines(body):
+            if in_headers:
+                skeleton += line
+                if line.strip():
+                    header_lines.append(line)
+                    continue
+                # Fin de las cabeceras de la parte
+                headers = header_parser.parsebytes(b"".join(header_lines))
+                header_lines = []
+                in_headers = False
+                if headers.get_content_maintype() == "multipart":
+                    boundary = headers.get_param("boundary")
+                    if boundary:
+                        boundaries.append(b"--" + boundary.encode("utf-8"))
+                elif headers.get_content_type() == "message/rfc822":
+                    # El cuerpo es otro email con sus propias cabeceras
+                    in_headers = True
+                elif should_offload(headers):
+                    number = len(attachments) + 1
+                    filename = SAFE_FILENAME.sub("_", headers.get_filename() or "")
+                    key = f"{prefix}{number}-{filename or 'adjunto'}"
+                    upload = AttachmentUpload(bucket, key, headers)
+                continue
+
+            marker = line.rstrip(b"\r\n") if len(line) < 1000 else None
+            if marker and boundaries and marker.startswith(b"--"):
+                matched = next(
+                    (
+                        i
+                        for i in range(len(boundaries) - 1, -1, -1)
+                        if marker in (boundaries[i], boundaries[i] + b"--")
+                    ),
+                    None,
+                )
+                if matched is not None:
+                    finish_upload()
+                    skeleton += line
+                    if marker.endswith(b"--") and marker != boundaries[matched]:
+                        del boundaries[matched:]
+                    else:
+                        del boundaries[matched + 1 :]
+                        in_headers = True
+                    continue
+
+            if upload is not None:
+                upload.feed(line)
+            else:
+                skeleton += line
+        finish_upload()
+    except Exception:
+        if upload is not None:
+            upload.writer.abort()
+        raise
+
+    for attachment in attachments:
+        logger.info(
+            f"Adjunto subido a S3: {attachment['key']} ({attachment['size']} bytes)"
+        )
+    return bytes(skeleton), attachments
@@ -0,0 +1,175 @@
+"""
+Registro de auditoría de las decisiones del triaje.
+
+Por cada email se guarda un registro compacto (ubicación en S3, remitente,
+decisión, motivo, regla de enrutado, tamaños y tiempos). Los registros se
+acumulan en memoria y se escriben una vez por invocación como un único objeto
+NDJSON comprimido con gzip, particionado por fecha:
+
+    audit/date=2024-05-01/103000-<uuid>.ndjson.gz
+
+Así se pueden analizar la precisión y el volumen del triaje con consultas
+masivas (Athena, DuckDB, zcat | jq) en lugar de buscar en los logs. Con
+AUDIT_LOCAL_DIR los objetos se escriben en un directorio local con la misma
+estructura (útil al probar en local). Las herramientas de operación leen los
+registros guardados con iter_audit_records.
+"""
+import gzip
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from resilience import call, paginate
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def object_key(prefix, day, now):
+    return f"{prefix}date={day}/{now:%H%M%S}-{uuid.uuid4().hex}.ndjson.gz"
+
+
+def encode_records(records):
+    """
+    Serializa los registros como NDJSON comprimido con gzip.
+    """
+    lines = (json.dumps(r, separators=(",", ":"), default=str) for r in records)
+    return gzip.compress(("\n".join(lines) + "\n").encode("utf-8"))
+
+
+def decode_records(data):
+    """
+    Registros de un objeto escrito con encode_records.
+    """
+    lines = gzip.decompress(data).decode("utf-8").splitlines()
+    return [json.loads(line) for line in lines if line]
+
+
+class S3AuditSink:
+    def __init__(self, s3_client, bucket, prefix="audit/"):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def write(self, day, data):
+        key = object_key(self.prefix, day, datetime.now(timezone.utc))
+        call(
+            "s3",
+            self.s3.put_object,
+            Bucket=self.bucket,
+            Key=key,
+            Body=data,
+            ContentType="application/x-ndjson",
+            ContentEncoding="gzip",
+        )
+        return key
+
+    def keys(self, since=""):
+        """
+        Claves de los objetos de auditoría de los días >= `since` (YYYY-MM-DD).
+        """
+        params = {"Bucket": self.bucket, "Prefix": self.prefix}
+        if since:
+            params["StartAfter"] = f"{self.prefix}date={since}/"
+        pages = paginate(
+            "s3",
+            self.s3.list_objects_v2,
+            "ContinuationToken",
+            "NextContinuationToken",
+            **params,
+        )
+        for page in pages:
+            for obj in page.get("Contents", []):
+                yield obj["Key"]
+
+    def read(self, key):
+        response = call("s3", self.s3.get_object, Bucket=self.bucket, Key=key)
+        return response["Body"].read()
+
+
+class LocalAuditSink:
+    def __init__(self, directory, prefix="audit/"):
+        self.directory = directory
+        self.prefix = prefix
+
+    def write(self, day, data):
+        key = object_key(self.prefix, day, datetime.now(timezone.utc))
+        path = os.path.join(self.directory, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return key
+
+    def keys(self, since=""):
+        start = f"{self.prefix}date={since}/" if since else self.prefix
+        keys = []
+        for root, _, files in os.walk(os.path.join(self.directory, self.prefix)):
+            for name in files:
+                path = os.path.join(root, name)
+                keys.append(os.path.relpath(path, self.directory).replace(os.sep, "/"))
+        return sorted(key for key in keys if key >= start)
+
+    def read(self, key):
+        with open(os.path.join(self.directory, key), "rb") as f:
+            return f.read()
+
+
+class AuditLog:
+    """
+    Acumula registros (se puede llamar a add() desde varios hilos) y los
+    escribe en el sink con flush(), un objeto por día.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.lock = threading.Lock()
+        self.records = []
+
+    def add(self, record):
+        record.setdefault("ts", datetime.now(timezone.utc).isoformat())
+        with self.lock:
+            self.records.append(record)
+
+    def flush(self):
+        """
+        Escribe lo acumulado y devuelve las claves creadas. Un fallo del sink
+        se registra y se descarta: la auditoría nunca hace fallar el triaje.
+        """
+        with self.lock:
+            records, self.records = self.records, []
+        by_day = defaultdict(list)
+        for record in records:
+            by_day[record["ts"][:10]].append(record)
+        keys = []
+        for day, day_records in by_day.items():
+            try:
+                keys.append(self.sink.write(day, encode_records(day_records)))
+            except Exception:
+                logger.exception(
+                    f"Error escribiendo {len(day_records)} registros de auditoría"
+                )
+        return keys
+
+
+def iter_audit_records(sink, since=""):
+    """
+    Recorre los registros guardados en `sink` de los días >= `since`.
+    """
+    for key in sink.keys(since):
+        yield from decode_records(sink.read(key))
+
+
+def load_audit_log(s3_client, bucket, local_dir, prefix="audit/"):
+    """
+    AuditLog con sink local si hay `local_dir`, en S3 si hay `bucket`, o None
+    si la auditoría está desactivada.
+    """
+    if local_dir:
+        return AuditLog(LocalAuditSink(local_dir, prefix))
+    if bucket:
+        return AuditLog(S3AuditSink(s3_client, bucket, prefix))
+    return None
@@ -0,0 +1,205 @@
+"""
+Herramienta de backfill: vuelve a pasar por el triaje los emails guardados en
+S3 (por defecto los de no_relevante/) después de un cambio en la lista de
+emails válidos.
+
+Los emails enviados al agente se quedan en emails/ (y los reenviados por un
+backfill anterior, en su carpeta), así que antes de empezar se leen del
+registro de auditoría los ya enviados y se saltan. Las decisiones del propio
+backfill también se auditan. Las claves que no se han podido procesar se
+guardan en el checkpoint y se muestran al final, porque al reanudar no se
+vuelven a listar.
+
+Uso:
+    python email_triage/backfill.py --bucket booking-automation-email-test \
+        --prefix no_relevante/ --workers 16 --rate 20
+"""
+import argparse
+import json
+import logging
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from app import (
+    load_valid_emails,
+    process_and_audit,
+    s3,
+    AUDIT_LOG,
+    FAILED,
+    FORWARDED,
+    THROTTLED,
+)
+from audit import iter_audit_records
+from rate_limit import RateLimiter
+from resilience import paginate
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def load_checkpoint(path):
+    """
+    Lee el checkpoint (última clave procesada y contadores) si existe.
+    """
+    if not path or not os.path.exists(path):
+        return {"start_after": "", "counts": {}, "failed_keys": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path, start_after, counts, failed_keys):
+    """
+    Guarda el checkpoint de forma atómica para poder reanudar el backfill.
+    """
+    if not path:
+        return
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(
+            {
+                "start_after": start_after,
+                "counts": dict(counts),
+                "failed_keys": failed_keys,
+            },
+            f,
+        )
+    os.replace(tmp_path, path)
+
+
+def iter_key_pages(bucket, prefix, start_after=""):
+    """
+    Lista el prefijo con ListObjectsV2 paginado y devuelve las claves página a
+    página (hasta 1000 por página), en orden lexicográfico.
+    """
+    params = {"Bucket": bucket, "Prefix": prefix}
+    if start_after:
+        params["StartAfter"] = start_after
+    pages = paginate(
+        "s3",
+        s3.list_objects_v2,
+        "ContinuationToken",
+        "NextContinuationToken",
+        **params,
+    )
+    for page in pages:
+        keys = [
+            obj["Key"]
+            for obj in page.get("Contents", [])
+            if not obj["Key"].endswith("/")
+        ]
+        if keys:
+            yield keys
+
+
+def forwarded_names(bucket, since=""):
+    """
+    Nombres de los emails de `bucket` ya enviados al agente según el registro
+    de auditoría (desde el día `since`). Se compara el nombre y no la clave
+    porque el email puede haber cambiado de carpeta.
+    """
+    return {
+        record["key"].rpartition("/")[2]
+        for record in iter_audit_records(AUDIT_LOG.sink, since)
+        if record.get("result") == FORWARDED
+        and record.get("bucket") == bucket
+        and record.get("key")
+    }
+
+
+def run_backfill(
+    bucket, prefix, workers=8, rate=10, checkpoint_path=None, audit_since=""
+):
+    """
+    Reprocesa todas las claves del prefijo repartiéndolas entre un pool de
+    hilos, salvo las ya enviadas al agente. El envío a SQS se limita a `rate`
+    mensajes por segundo y el progreso se guarda tras cada página, de modo
+    que una ejecución interrumpida se reanuda desde la última página
+    completada. Devuelve los contadores por resultado y las claves que han
+    fallado.
+    """
+    checkpoint = load_checkpoint(checkpoint_path)
+    counts = Counter(checkpoint.get("counts", {}))
+    failed_keys = dict(checkpoint.get("failed_keys", {}))
+    valid_emails = load_valid_emails()
+    if valid_emails is None:
+        raise RuntimeError("La lista de emails válidos no está disponible")
+    if AUDIT_LOG is not None:
+        skip = forwarded_names(bucket, audit_since)
+        logger.info(f"{len(skip)} emails ya enviados según la auditoría")
+    elif prefix.startswith("emails/"):
+        raise RuntimeError(
+            "Sin registro de auditoría (AUDIT_BUCKET) no se pueden saltar los "
+            "emails de emails/ ya enviados al agente"
+        )
+    else:
+        logger.warning("Sin registro de auditoría; no se saltan los ya enviados")
+        skip = set()
+    rate_limiter = RateLimiter(rate)
+
+    def handle(key):
+        name = key.rpartition("/")[2]
+        if name in skip:
+            return "already_forwarded"
+        try:
+            result = process_and_audit(
+                "backfill", bucket, key, valid_emails, rate_limiter, sender_limit=False
+            )
+        except Exception:
+            logger.exception(f"Error reprocesando {key}")
+            return FAILED
+        if result == FORWARDED:
+            skip.add(name)
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for keys in iter_key_pages(bucket, prefix, checkpoint.get("start_after", "")):
+            results = list(executor.map(handle, keys))
+            counts.update(results)
+            for key, result in zip(keys, results):
+                if result in (FAILED, THROTTLED):
+                    failed_keys[key] = result
+                else:
+                    failed_keys.pop(key, None)
+            if AUDIT_LOG is not None:
+                AUDIT_LOG.flush()
+            save_checkpoint(checkpoint_path, keys[-1], counts, failed_keys)
+            logger.info(f"Backfill hasta {keys[-1]}: {dict(counts)}")
+
+    return {"counts": dict(counts), "failed_keys": failed_keys}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-triaje de emails en S3")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--prefix", default="no_relevante/")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=10,
+        help="Mensajes SQS por segundo (0 = sin límite)",
+    )
+    parser.add_argument("--checkpoint", default="backfill_checkpoint.json")
+    parser.add_argument(
+        "--audit-since",
+        default="",
+        help="Leer la auditoría desde este día (YYYY-MM-DD; por defecto toda)",
+    )
+    args = parser.parse_args()
+
+    summary = run_backfill(
+        args.bucket,
+        args.prefix,
+        args.workers,
+        args.rate,
+        args.checkpoint,
+        args.audit_since,
+    )
+    print(json.dumps(summary["counts"]))
+    for key, result in sorted(summary["failed_keys"].items()):
+        print(f"{result}\t{key}")
+
+
+if __name__ == "__main__":
+    main()
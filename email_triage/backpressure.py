@@ -0,0 +1,76 @@
+"""
+Backpressure hacia el agente: si la cola del agente acumula demasiados
+mensajes, los emails de baja prioridad se envían a una cola diferida que el
+agente consume cuando tiene capacidad, y los urgentes siguen entrando.
+
+La profundidad de cada cola (ApproximateNumberOfMessages) se consulta como
+mucho una vez cada `sample_seconds` por contenedor.
+"""
+import logging
+import threading
+import time
+
+from resilience import call
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class BackpressureController:
+    def __init__(self, sqs_client, threshold, deferred_queue_url, sample_seconds=30):
+        self.sqs = sqs_client
+        self.threshold = threshold
+        self.deferred_queue_url = deferred_queue_url
+        self.sample_seconds = sample_seconds
+        self.lock = threading.Lock()
+        # queue_url -> (profundidad, momento de la consulta)
+        self.samples = {}
+
+    @property
+    def enabled(self):
+        return self.threshold > 0 and bool(self.deferred_queue_url)
+
+    def depth(self, queue_url):
+        """
+        Profundidad de la cola, cacheada `sample_seconds`. None si no se ha
+        podido consultar.
+        """
+        now = time.monotonic()
+        with self.lock:
+            sample = self.samples.get(queue_url)
+            if sample and now - sample[1] < self.sample_seconds:
+                return sample[0]
+        try:
+            response = call(
+                "sqs",
+                self.sqs.get_queue_attributes,
+                QueueUrl=queue_url,
+                AttributeNames=["ApproximateNumberOfMessages"],
+            )
+            depth = int(response["Attributes"]["ApproximateNumberOfMessages"])
+        except Exception:
+            logger.exception(f"No se pudo consultar la profundidad de {queue_url}")
+            depth = None
+        with self.lock:
+            self.samples[queue_url] = (depth, now)
+        return depth
+
+    def overloaded(self, queue_url):
+        depth = self.depth(queue_url)
+        return depth is not None and depth > self.threshold
+
+    def route(self, queue_urls, high_priority):
+        """
+        Sustituye por la cola diferida las colas saturadas si el email no es
+        urgente. Devuelve (colas, número de colas diferidas).
+        """
+        if not self.enabled or high_priority:
+            return queue_urls, 0
+        routed, deferred = [], 0
+        for queue_url in queue_urls:
+            if queue_url != self.deferred_queue_url and self.overloaded(queue_url):
+                routed.append(self.deferred_queue_url)
+                deferred += 1
+            else:
+                routed.append(queue_url)
+        return list(dict.fromkeys(routed)), deferred
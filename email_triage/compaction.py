@@ -0,0 +1,287 @@
+"""
+Compactación diaria de no_relevante/.
+
+Agrupa los emails de no_relevante/ por día (LastModified, UTC) y, para cada día
+anterior a hoy, los empaqueta en un único objeto con cada email comprimido por
+separado (miembros gzip concatenados) y un índice con el offset y la longitud
+de cada uno. Después borra los originales, indicando la versión leída: el
+bucket tiene versionado y un borrado sin VersionId solo añadiría un delete
+marker y dejaría el email como versión no actual. Un email archivado se
+recupera con una sola lectura por rango de bytes.
+
+    archive/no_relevante/<YYYY-MM-DD>/<run_id>.bundle
+    archive/no_relevante/<YYYY-MM-DD>/<run_id>.index.json
+
+Lectura de un email archivado:
+    python email_triage/compaction.py --bucket <bucket> --day 2024-12-07 \
+        --key no_relevante/<id> > email.eml
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import sys
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import boto3
+
+from resilience import BOTO_CONFIG, call, paginate
+from snapstart import recreatable
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+s3 = recreatable(lambda: boto3.client("s3", config=BOTO_CONFIG))
+
+SOURCE_PREFIX = "no_relevante/"
+ARCHIVE_PREFIX = "archive/no_relevante/"
+# Tamaño de cada parte del multipart upload (mínimo de S3: 5 MB)
+PART_SIZE = 8 * 1024 * 1024
+DELETE_BATCH = 1000
+
+
+class BundleWriter:
+    """
+    Escribe el bundle en S3 sin tenerlo entero en memoria: usa multipart
+    upload en cuanto supera PART_SIZE y un put_object simple si no. Todas las
+    llamadas pasan por la capa de resiliencia (también la usa
+    attachments.offload_attachments durante el triaje).
+    """
+
+    def __init__(self, bucket, key):
+        self.bucket = bucket
+        self.key = key
+        self.buffer = bytearray()
+        self.offset = 0
+        self.upload_id = None
+        self.parts = []
+
+    def write(self, data):
+        """
+        Añade `data` al bundle y devuelve su offset.
+        """
+        offset = self.offset
+        self.buffer += data
+        self.offset += len(data)
+        if len(self.buffer) >= PART_SIZE:
+            self._upload_part()
+        return offset
+
+    def _upload_part(self):
+        if self.upload_id is None:
+            self.upload_id = call(
+                "s3", s3.create_multipart_upload, Bucket=self.bucket, Key=self.key
+            )["UploadId"]
+        number = len(self.parts) + 1
+        response = call(
+            "s3",
+            s3.upload_part,
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=number,
+            Body=bytes(self.buffer),
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": number})
+        self.buffer = bytearray()
+
+    def close(self):
+        if self.upload_id is None:
+            call(
+                "s3",
+                s3.put_object,
+                Bucket=self.bucket,
+                Key=self.key,
+                Body=bytes(self.buffer),
+            )
+            return
+        if self.buffer:
+            self._upload_part()
+        call(
+            "s3",
+            s3.complete_multipart_upload,
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts},
+        )
+
+    def abort(self):
+        if self.upload_id is not None:
+            call(
+                "s3",
+                s3.abort_multipart_upload,
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+            )
+
+
+def list_objects_by_day(bucket, prefix, before_day):
+    """
+    Lista el prefijo y agrupa las claves por día de LastModified, solo para
+    días anteriores a `before_day` (YYYY-MM-DD).
+    """
+    days = defaultdict(list)
+    for page in paginate(
+        "s3",
+        s3.list_objects_v2,
+        "ContinuationToken",
+        "NextContinuationToken",
+        Bucket=bucket,
+        Prefix=prefix,
+    ):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith("/"):
+                continue
+            day = obj["LastModified"].astimezone(timezone.utc).strftime("%Y-%m-%d")
+            if day < before_day:
+                days[day].append(obj["Key"])
+    return days
+
+
+def delete_objects(bucket, keys, versions=None):
+    """
+    Borra las claves; con `versions` (clave -> VersionId) se borra esa versión
+    de forma definitiva en lugar de añadir un delete marker.
+    """
+    versions = versions or {}
+    objects = []
+    for key in keys:
+        obj = {"Key": key}
+        if versions.get(key):
+            obj["VersionId"] = versions[key]
+        objects.append(obj)
+    for i in range(0, len(objects), DELETE_BATCH):
+        response = call(
+            "s3",
+            s3.delete_objects,
+            Bucket=bucket,
+            Delete={"Objects": objects[i : i + DELETE_BATCH], "Quiet": True},
+        )
+        for error in response.get("Errors", []):
+            logger.error(f"No se pudo borrar {error.get('Key')}: {error}")
+
+
+def compact_day(bucket, day, keys, run_id):
+    """
+    Empaqueta los emails de un día, guarda el índice y borra los originales.
+    Devuelve la clave del índice.
+    """
+    base_key = f"{ARCHIVE_PREFIX}{day}/{run_id}"
+    writer = BundleWriter(bucket, base_key + ".bundle")
+    entries = {}
+    versions = {}
+    try:
+        for key in keys:
+            response = call("s3", s3.get_object, Bucket=bucket, Key=key)
+            raw_email = response["Body"].read()
+            versions[key] = response.get("VersionId")
+            member = gzip.compress(raw_email)
+            entries[key] = {
+                "offset": writer.write(member),
+                "length": len(member),
+                "size": len(raw_email),
+            }
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+
+    index_key = base_key + ".index.json"
+    call(
+        "s3",
+        s3.put_object,
+        Bucket=bucket,
+        Key=index_key,
+        Body=json.dumps(
+            {
+                "version": 1,
+                "day": day,
+                "bundle": base_key + ".bundle",
+                "entries": entries,
+            },
+            separators=(",", ":"),
+        ).encode("utf-8"),
+        ContentType="application/json",
+    )
+    # Solo se borra cuando bundle e índice están guardados
+    delete_objects(bucket, list(entries), versions)
+    logger.info(f"Compactados {len(entries)} emails de {day} en {index_key}")
+    return index_key
+
+
+def read_bundle_entry(bucket, bundle_key, entry):
+    """
+    Lee un email del bundle con una petición por rango de bytes.
+    """
+    end = entry["offset"] + entry["length"] - 1
+    member = call(
+        "s3",
+        s3.get_object,
+        Bucket=bucket,
+        Key=bundle_key,
+        Range=f"bytes={entry['offset']}-{end}",
+    )["Body"].read()
+    return gzip.decompress(member)
+
+
+def read_archived_email(bucket, day, key):
+    """
+    Devuelve el contenido original de un email archivado o None si no está en
+    los bundles de ese día. Solo descarga los bytes de ese email.
+    """
+    for page in paginate(
+        "s3",
+        s3.list_objects_v2,
+        "ContinuationToken",
+        "NextContinuationToken",
+        Bucket=bucket,
+        Prefix=f"{ARCHIVE_PREFIX}{day}/",
+    ):
+        for obj in page.get("Contents", []):
+            if not obj["Key"].endswith(".index.json"):
+                continue
+            response = call("s3", s3.get_object, Bucket=bucket, Key=obj["Key"])
+            index = json.loads(response["Body"].read())
+            entry = index["entries"].get(key)
+            if not entry:
+                continue
+            return read_bundle_entry(bucket, index["bundle"], entry)
+    return None
+
+
+def compaction_handler(event, context):
+    """
+    Lambda programada: compacta todos los días completos de no_relevante/.
+    """
+    bucket = os.environ["EMAIL_BUCKET"]
+    now = datetime.now(timezone.utc)
+    today = now.strftime("%Y-%m-%d")
+    run_id = now.strftime("%Y%m%dT%H%M%S")
+
+    days = list_objects_by_day(bucket, SOURCE_PREFIX, today)
+    compacted = {}
+    for day, keys in sorted(days.items()):
+        compact_day(bucket, day, keys, run_id)
+        compacted[day] = len(keys)
+    return {"statusCode": 200, "body": json.dumps(compacted)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lee un email archivado")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--day", required=True, help="YYYY-MM-DD")
+    parser.add_argument("--key", required=True)
+    args = parser.parse_args()
+
+    raw_email = read_archived_email(args.bucket, args.day, args.key)
+    if raw_email is None:
+        sys.exit(f"{args.key} no está archivado en {args.day}")
+    sys.stdout.buffer.write(raw_email)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+Detección de emails casi duplicados (confirmación, recordatorio y
+modificaciones de la misma reserva con cambios mínimos).
+
+Se calcula un SimHash de 64 bits del asunto y cuerpo normalizados y se compara
+con las huellas recientes guardadas para la misma referencia de reserva en un
+índice con TTL (tabla de DynamoDB o, en local, memoria).
+
+Cada huella se guarda con el email del que procede (message id de SES o nombre
+del objeto en S3) y solo cuando el email se ha enviado al agente: así un
+reintento, un redrive o un backfill del mismo email no se detecta como
+duplicado de sí mismo.
+"""
+import hashlib
+import html
+import logging
+import re
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from resilience import call
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Huellas que se guardan por referencia de reserva
+MAX_FINGERPRINTS = 10
+# Distancia de Hamming máxima para considerar dos emails casi iguales
+DEFAULT_MAX_DISTANCE = 3
+# Intentos de add() cuando otro email de la misma reserva escribe a la vez
+MAX_ADD_ATTEMPTS = 5
+
+# Solo la etiqueta distingue mayúsculas; la referencia va en mayúsculas y
+# lleva al menos un dígito, para no tomar por referencia "confirmed" o
+# "pendiente"
+REFERENCE = r"(?=[A-Z0-9-]*\d)([A-Z0-9][A-Z0-9-]{4,})"
+BOOKING_REFERENCE_PATTERNS = [
+    re.compile(r"(?i:booking\s+(?:reference|ref\.?|number|id))\s*[:#]?\s*" + REFERENCE),
+    re.compile(
+        r"(?i:referencia|localizador|n[úu]mero de reserva)\s*[:#]?\s*" + REFERENCE
+    ),
+    re.compile(r"#\s*([A-Z]{2,4}-?\d{6,})"),
+]
+TAG_PATTERN = re.compile(r"<[^>]+>")
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def extract_booking_reference(text):
+    """
+    Busca la referencia de la reserva en el texto. Devuelve None si no hay.
+    """
+    for pattern in BOOKING_REFERENCE_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            return match.group(1).upper()
+    return None
+
+
+def normalize_text(text):
+    """
+    Quita etiquetas HTML y entidades, pasa a minúsculas y separa en palabras.
+    """
+    text = html.unescape(TAG_PATTERN.sub(" ", text))
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def simhash(text, shingle_size=3):
+    """
+    SimHash de 64 bits sobre shingles de `shingle_size` palabras.
+    """
+    tokens = normalize_text(text)
+    if len(tokens) < shingle_size:
+        shingles = [" ".join(tokens)]
+    else:
+        shingles = [
+            " ".join(tokens[i : i + shingle_size])
+            for i in range(len(tokens) - shingle_size + 1)
+        ]
+    weights = [0] * 64
+    for shingle in shingles:
+        h = int.from_bytes(
+            hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little"
+        )
+        for bit in range(64):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class LocalFingerprintIndex:
+    """
+    Índice de huellas en memoria; sustituye a DynamoDB en local o cuando no hay
+    tabla configurada.
+    """
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.items = {}
+
+    def _get(self, reference):
+        fingerprints, expires_at = self.items.get(reference, ([], 0))
+        return list(fingerprints) if expires_at >= time.time() else []
+
+    def get(self, reference):
+        """
+        Lista de (huella, email de origen).
+        """
+        with self.lock:
+            return self._get(reference)
+
+    def add(self, reference, fingerprint, source=None):
+        with self.lock:
+            fingerprints = [
+                f for f in self._get(reference) if source is None or f[1] != source
+            ]
+            fingerprints.append((fingerprint, source))
+            self.items[reference] = (
+                fingerprints[-MAX_FINGERPRINTS:],
+                time.time() + self.ttl_seconds,
+            )
+
+
+class DynamoFingerprintIndex:
+    """
+    Índice de huellas en una tabla de DynamoDB con clave `pk` (referencia de
+    reserva) y TTL en `expires_at`. Cada huella se guarda como
+    "<huella en hex>:<email de origen>". Cada escritura incrementa `version`
+    y solo se aplica si nadie ha escrito desde la lectura, para no perder las
+    huellas de dos emails de la misma reserva procesados a la vez.
+    """
+
+    def __init__(self, table, ttl_seconds):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+
+    def _get_item(self, reference, consistent=False):
+        return call(
+            "dynamodb",
+            self.table.get_item,
+            Key={"pk": reference},
+            ConsistentRead=consistent,
+        ).get("Item")
+
+    @staticmethod
+    def _fingerprints(item):
+        if not item or int(item.get("expires_at", 0)) < time.time():
+            return []
+        fingerprints = []
+        for entry in item.get("fingerprints", []):
+            fingerprint, _, source = entry.partition(":")
+            fingerprints.append((int(fingerprint, 16), source or None))
+        return fingerprints
+
+    def get(self, reference):
+        """
+        Lista de (huella, email de origen).
+        """
+        return self._fingerprints(self._get_item(reference))
+
+    def add(self, reference, fingerprint, source=None):
+        for _ in range(MAX_ADD_ATTEMPTS):
+            item = self._get_item(reference, consistent=True)
+            fingerprints = [
+                f
+                for f in self._fingerprints(item)
+                if source is None or f[1] != source
+            ]
+            fingerprints.append((fingerprint, source))
+            if item is None:
+                condition = {"ConditionExpression": "attribute_not_exists(pk)"}
+            elif "version" not in item:
+                condition = {"ConditionExpression": "attribute_not_exists(version)"}
+            else:
+                condition = {
+                    "ConditionExpression": "version = :version",
+                    "ExpressionAttributeValues": {":version": item["version"]},
+                }
+            try:
+                call(
+                    "dynamodb",
+                    self.table.put_item,
+                    Item={
+                        "pk": reference,
+                        "fingerprints": [
+                            f"{f:016x}:{s or ''}"
+                            for f, s in fingerprints[-MAX_FINGERPRINTS:]
+                        ],
+                        "expires_at": int(time.time() + self.ttl_seconds),
+                        "version": int(item.get("version", 0)) + 1 if item else 1,
+                    },
+                    **condition,
+                )
+                return
+            except ClientError as e:
+                code = e.response.get("Error", {}).get("Code")
+                if code != "ConditionalCheckFailedException":
+                    raise
+        raise RuntimeError(
+            f"La huella de {reference} no se ha guardado tras {MAX_ADD_ATTEMPTS} "
+            "escrituras concurrentes"
+        )
+
+
+class DuplicateDetector:
+    """
+    Comprueba si un email es casi igual a uno anterior de la misma reserva.
+    """
+
+    def __init__(self, index, max_distance=DEFAULT_MAX_DISTANCE):
+        self.index = index
+        self.max_distance = max_distance
+
+    def check(self, text, source=None):
+        """
+        Devuelve (referencia, es_duplicado, huella). Los emails sin referencia
+        de reserva nunca se consideran duplicados, ni las huellas guardadas por
+        el mismo email `source`. La huella no se guarda: hay que llamar a
+        remember() cuando el email se haya enviado.
+        """
+        reference = extract_booking_reference(text)
+        if not reference:
+            return None, False, None
+        fingerprint = simhash(text)
+        try:
+            previous = self.index.get(reference)
+            duplicate = any(
+                hamming_distance(fingerprint, f) <= self.max_distance
+                for f, origin in previous
+                if source is None or origin != source
+            )
+        except Exception:
+            logger.exception("Error consultando el índice de duplicados")
+            return reference, False, fingerprint
+        return reference, duplicate, fingerprint
+
+    def remember(self, reference, fingerprint, source=None):
+        """
+        Guarda la huella de un email ya enviado al agente.
+        """
+        if not reference or fingerprint is None:
+            return
+        try:
+            self.index.add(reference, fingerprint, source)
+        except Exception:
+            logger.exception("Error guardando la huella en el índice de duplicados")
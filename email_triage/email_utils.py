@@ -1,6 +1,5 @@
-from email import policy
-from email.parser import BytesParser
-from email.utils import getaddresses
+import gzip
+import json
 import logging
 import os
 import re
@@ -9,107 +8,202 @@ import re
 import boto3
 from botocore.exceptions import ClientError
 
+from allowlist_snapshot import normalize_email
+from attachments import ATTACHMENTS_PREFIX, offload_attachments
+from mime_decode import (
+    decode_addresses,
+    decode_header_value,
+    decode_text,
+    parse_message,
+    raw_headers,
+)
+from resilience import BOTO_CONFIG, call
+from snapstart import recreatable
+
 
 # Configuración de logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 # Inicialización de clientes AWS
-sqs = boto3.client("sqs")
-s3 = boto3.client("s3")
+sqs = recreatable(lambda: boto3.client("sqs", config=BOTO_CONFIG))
+s3 = recreatable(lambda: boto3.client("s3", config=BOTO_CONFIG))
 # Cargar lista de emails válidos desde Excel
 environment = os.environ.get("Environment", "test")
 
+# Caché del email ya parseado, junto al original y indexada por su ETag
+PARSED_PREFIX = "parsed/"
+PARSED_CACHE_ENABLED = os.environ.get("PARSED_CACHE_ENABLED", "true") == "true"
+# Subir los adjuntos a S3 en streaming en lugar de leer el email entero
+ATTACHMENT_OFFLOAD_ENABLED = (
+    os.environ.get("ATTACHMENT_OFFLOAD_ENABLED", "true") == "true"
+)
+
 
 def extract_email_headers(msg):
     """
-    Extrae los headers relevantes: From, To, Cc, Bcc y Subject.
+    Extrae los headers relevantes: From, To, Cc, Bcc, Subject y los de la
+    conversación (Message-ID, In-Reply-To y References).
     Se convierten las direcciones a una lista de tuplas (nombre, email).
     """
+    raw = raw_headers(msg)
     headers = {}
-    headers["from"] = getaddresses([msg.get("From", "")])
-    headers["to"] = getaddresses(msg.get_all("To", []))
-    headers["cc"] = getaddresses(msg.get_all("Cc", []))
-    headers["bcc"] = getaddresses(msg.get_all("Bcc", []))
-    headers["subject"] = msg.get("Subject", "")
+    headers["from"] = decode_addresses(raw.get("from", [])[:1])
+    sender = headers["from"][0][1].lower() if headers["from"] else None
+    headers["to"] = decode_addresses(raw.get("to", []), sender)
+    headers["cc"] = decode_addresses(raw.get("cc", []), sender)
+    headers["bcc"] = decode_addresses(raw.get("bcc", []), sender)
+    headers["subject"] = decode_header_value(raw.get("subject", [""])[0], sender)
+    for name in ("message-id", "in-reply-to", "references"):
+        value = decode_header_value(raw.get(name, [""])[0]).strip()
+        headers[name.replace("-", "_")] = value
     return headers
 
 
-def extract_email_body(msg):
+def extract_email_body(msg, sender=None):
     """
     Extrae todo el contenido del email:
     - 'plain': texto plano
     - 'html': versión en HTML
+    Cada parte se decodifica con mime_decode.decode_text, que corrige los
+    charsets ausentes o mal declarados.
     """
     email_body_plain = ""
     email_body_html = ""
 
-    if msg.is_multipart():
-        # Recorremos todas las partes del mensaje
-        for part in msg.walk():
-            content_type = part.get_content_type()
-            if content_type == "text/plain":
-                try:
-                    email_body_plain += part.get_payload(decode=True).decode(
-                        part.get_content_charset() or "utf-8", errors="replace"
-                    )
-                except Exception as e:
-                    logger.error("Error decodificando text/plain: " + str(e))
-            elif content_type == "text/html":
-                try:
-                    email_body_html += part.get_payload(decode=True).decode(
-                        part.get_content_charset() or "utf-8", errors="replace"
-                    )
-                except Exception as e:
-                    logger.error("Error decodificando text/html: " + str(e))
-    else:
-        # Caso de email no multipart
-        content_type = msg.get_content_type()
+    # En un email no multipart walk() devuelve solo el propio mensaje
+    for part in msg.walk():
+        content_type = part.get_content_type()
+        if content_type not in ("text/plain", "text/html"):
+            continue
         try:
-            if content_type == "text/plain":
-                email_body_plain = msg.get_payload(decode=True).decode(
-                    msg.get_content_charset() or "utf-8", errors="replace"
-                )
-            elif content_type == "text/html":
-                email_body_html = msg.get_payload(decode=True).decode(
-                    msg.get_content_charset() or "utf-8", errors="replace"
-                )
+            text = decode_text(
+                part.get_payload(decode=True), part.get_content_charset(), sender
+            )
         except Exception as e:
-            logger.error("Error decodificando el contenido: " + str(e))
+            logger.error(f"Error decodificando {content_type}: {e}")
+            continue
+        if content_type == "text/plain":
+            email_body_plain += text
+        else:
+            email_body_html += text
 
     return {"plain": email_body_plain, "html": email_body_html}
 
 
-def read_email_in_s3(bucket_name, s3_key):
+def parse_email_bytes(raw_email):
+    """
+    Parsea el email en formato MIME y devuelve sus headers y cuerpo.
+    """
+    msg = parse_message(raw_email)
+    headers = extract_email_headers(msg)
+    sender = headers["from"][0][1].lower() if headers["from"] else None
+    return {"headers": headers, "body": extract_email_body(msg, sender)}
+
+
+def parsed_cache_key(etag):
+    """
+    Clave del email parseado. Se indexa por ETag y no por clave para que siga
+    siendo válida cuando el email se mueve de carpeta.
+    """
+    return PARSED_PREFIX + etag.strip('"') + ".json.gz"
+
+
+def read_parsed_cache(bucket_name, cache_key):
+    """
+    Devuelve el email parseado guardado en `cache_key` o None si no existe.
+    """
+    try:
+        cached = call("s3", s3.get_object, Bucket=bucket_name, Key=cache_key)
+    except ClientError:
+        return None
+    return json.loads(gzip.decompress(cached["Body"].read()))
+
+
+def write_parsed_cache(bucket_name, cache_key, email_content):
+    """
+    Guarda el email parseado (JSON compacto comprimido con gzip).
+    """
+    try:
+        payload = json.dumps(email_content, separators=(",", ":"), ensure_ascii=False)
+        call(
+            "s3",
+            s3.put_object,
+            Bucket=bucket_name,
+            Key=cache_key,
+            Body=gzip.compress(payload.encode("utf-8")),
+            ContentType="application/json",
+            ContentEncoding="gzip",
+        )
+    except Exception:
+        logger.exception("Error guardando el email parseado en S3")
+
+
+def read_email_in_s3(bucket_name, s3_key, use_parsed_cache=False):
     """
     Obtiene el objeto de S3 y retorna el email procesado.
+    Con `use_parsed_cache` (reintentos y reprocesos) se busca antes el email
+    ya parseado y, si existe, no se descarga ni se parsea el original. El
+    resultado incluye "parsed_key" cuando la caché está activada y en
+    "attachments" los adjuntos subidos a S3.
     """
     try:
-        s3_object = s3.get_object(Bucket=bucket_name, Key=s3_key)
-        raw_email = s3_object["Body"].read()
-        msg = BytesParser(policy=policy.default).parsebytes(raw_email)
-        headers = extract_email_headers(msg)
-        body = extract_email_body(msg)
+        s3_object = call("s3", s3.get_object, Bucket=bucket_name, Key=s3_key)
+        cache_key = None
+        if PARSED_CACHE_ENABLED and s3_object.get("ETag"):
+            cache_key = parsed_cache_key(s3_object["ETag"])
+            if use_parsed_cache:
+                cached = read_parsed_cache(bucket_name, cache_key)
+                if cached:
+                    s3_object["Body"].close()
+                    logger.info("Email parseado leído de caché: %s", cache_key)
+                    return dict(cached, parsed_key=cache_key)
+
+        if ATTACHMENT_OFFLOAD_ENABLED:
+            prefix = f"{ATTACHMENTS_PREFIX}{s3_key.rpartition('/')[2]}/"
+            raw_email, attachments = offload_attachments(
+                s3_object["Body"], bucket_name, prefix
+            )
+        else:
+            raw_email, attachments = s3_object["Body"].read(), []
+        email_content = parse_email_bytes(raw_email)
+        email_content["attachments"] = attachments
+        headers = email_content["headers"]
+        body = email_content["body"]
         logger.info("Remitente(s): %s", headers["from"])
         logger.info("Asunto: %s", headers["subject"])
         logger.info("Cuerpo (texto plano, primeros 500): %s", body["plain"][:500])
         logger.info("Cuerpo (HTML, primeros 500): %s", body["html"][:500])
 
-        return {"headers": headers, "body": body}
+        if cache_key:
+            write_parsed_cache(bucket_name, cache_key, email_content)
+            email_content["parsed_key"] = cache_key
+        return email_content
     except Exception as e:
         logger.error("Error leyendo email desde S3: " + str(e))
         return None
 
 
-def should_email_be_processed(email_content, valid_emails):
+def extract_sender(email_content):
     """
-    Extrae el remitente del email buscando el header "From:" en el contenido y
-    verifica si se encuentra en la lista de emails de reservas.
+    Extrae el remitente del email buscando el header "From:" en el contenido.
+    Devuelve None si no se encuentra.
     """
     match = re.search(r"^From:.*<([^>]+)>", email_content, re.IGNORECASE | re.MULTILINE)
     if match:
-        sender = match.group(1).strip()
-        if sender in valid_emails:
+        return match.group(1).strip()
+    return None
+
+
+def should_email_be_processed(email_content, valid_emails):
+    """
+    Extrae el remitente del email buscando el header "From:" en el contenido y
+    verifica si se encuentra en la lista de emails de reservas. Se compara
+    normalizado (normalize_email), igual que se guarda la lista.
+    """
+    sender = extract_sender(email_content)
+    if sender:
+        if normalize_email(sender) in valid_emails:
             logger.info(f"El email {sender} está en la lista de emails de reservas")
             return True
         else:
@@ -120,15 +214,18 @@ def should_email_be_processed(email_content, valid_emails):
         return False
 
 
-def send_queue_message(queue_url, msg_attributes, msg_body):
+def send_queue_message(queue_url, msg_attributes, msg_body, delay_seconds=0):
     """
     Envía un mensaje a la cola SQS especificada.
     """
     try:
-        response = sqs.send_message(
+        response = call(
+            "sqs",
+            sqs.send_message,
             QueueUrl=queue_url,
             MessageAttributes=msg_attributes,
             MessageBody=msg_body,
+            DelaySeconds=delay_seconds,
         )
         return response
     except ClientError:
@@ -136,18 +233,45 @@ def send_queue_message(queue_url, msg_attributes, msg_body):
         raise
 
 
-def move_email_to_no_relevante(s3_bucket, s3_object):
+def send_queue_message_batch(queue_url, entries):
     """
-    Mueve el objeto del email de la carpeta "emails/" a "no_relevante/" en S3.
+    Envía un lote de hasta 10 mensajes a la cola SQS especificada.
+    """
+    try:
+        return call(
+            "sqs", sqs.send_message_batch, QueueUrl=queue_url, Entries=entries
+        )
+    except ClientError:
+        logger.exception(f"Could not send message batch to the queue: {queue_url}.")
+        raise
+
+
+def move_email_to_prefix(s3_bucket, s3_object, prefix, from_prefix="emails/"):
+    """
+    Mueve el objeto del email de la carpeta `from_prefix` (por defecto
+    "emails/") a la carpeta `prefix`.
     """
     try:
-        new_key = s3_object.replace("emails/", "no_relevante/")
-        s3.copy_object(
+        new_key = s3_object.replace(from_prefix, prefix)
+        if new_key == s3_object:
+            # Ya está fuera de from_prefix (p. ej. al reprocesar con backfill)
+            logger.info(f"Email not moved, already outside {from_prefix}: {s3_object}")
+            return
+        call(
+            "s3",
+            s3.copy_object,
             Bucket=s3_bucket,
             CopySource={"Bucket": s3_bucket, "Key": s3_object},
             Key=new_key,
         )
-        s3.delete_object(Bucket=s3_bucket, Key=s3_object)
-        logger.info(f"Email moved to no_relevante folder: {new_key}")
+        call("s3", s3.delete_object, Bucket=s3_bucket, Key=s3_object)
+        logger.info(f"Email moved to {prefix} folder: {new_key}")
     except Exception:
         logger.exception("Error moving the email")
+
+
+def move_email_to_no_relevante(s3_bucket, s3_object):
+    """
+    Mueve el objeto del email de la carpeta "emails/" a "no_relevante/" en S3.
+    """
+    move_email_to_prefix(s3_bucket, s3_object, "no_relevante/")
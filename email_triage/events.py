@@ -0,0 +1,160 @@
+"""
+Adaptadores de eventos de entrada. El triaje puede recibir los emails por
+varias topologías y cada adaptador convierte su evento en TriageRecord:
+
+- "sqs": SES -> S3 -> SNS -> SQS -> Lambda (la topología desplegada). El
+  cuerpo del mensaje es la notificación de SES, el sobre de SNS sin
+  desempaquetar o una notificación de S3 (S3 -> SQS).
+- "s3": notificación ObjectCreated de S3 invocando la Lambda directamente.
+- "ses": acción Lambda de la regla de recepción de SES, después de la acción
+  S3 que guarda el email en EMAIL_PREFIX + message id.
+- "eventbridge": evento "Object Created" de S3 enviado por EventBridge.
+
+Solo se triajan los objetos bajo EMAIL_PREFIX: el resto del bucket (parsed/,
+attachments/, audit/...) lo escribe el propio triaje.
+"""
+import json
+import logging
+import os
+from urllib.parse import unquote_plus
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+EMAIL_PREFIX = os.getenv("EMAIL_PREFIX", "emails/")
+# Bucket de la acción S3 de SES, para los eventos "ses" (no lo incluyen)
+SES_EMAIL_BUCKET = os.getenv("SES_EMAIL_BUCKET", "")
+
+
+class TriageRecord:
+    """
+    Email a triar, independiente del evento que lo ha entregado.
+    `record_id` identifica el mensaje de origen en los fallos (messageId de
+    SQS) y `sqs_attributes` son los atributos del mensaje SQS, si lo hay.
+    """
+
+    def __init__(
+        self,
+        record_id,
+        bucket,
+        key,
+        source,
+        ses_message_id=None,
+        receipt_time=None,
+        sqs_attributes=None,
+    ):
+        self.record_id = record_id
+        self.bucket = bucket
+        self.key = key
+        self.source = source
+        self.ses_message_id = ses_message_id
+        self.receipt_time = receipt_time
+        self.sqs_attributes = sqs_attributes or {}
+
+    @property
+    def receive_count(self):
+        return int(self.sqs_attributes.get("ApproximateReceiveCount", 1))
+
+
+def from_ses_notification(notification, record_id, source, sqs_attributes=None):
+    """
+    Registro a partir de una notificación de SES (acción S3 con SNS o acción
+    Lambda).
+    """
+    mail = notification.get("mail", {})
+    receipt = notification.get("receipt", {})
+    action = receipt.get("action", {})
+    bucket, key = action.get("bucketName"), action.get("objectKey")
+    if action.get("type") == "Lambda" and mail.get("messageId"):
+        bucket, key = SES_EMAIL_BUCKET, EMAIL_PREFIX + mail["messageId"]
+    return TriageRecord(
+        record_id,
+        bucket,
+        key,
+        source,
+        mail.get("messageId"),
+        receipt.get("timestamp") or mail.get("timestamp"),
+        sqs_attributes,
+    )
+
+
+def from_s3_object(bucket, key, event_time, record_id, source, sqs_attributes=None):
+    """
+    Registro a partir de un objeto creado en S3; el message id de SES es el
+    nombre del objeto. None si el objeto no es un email entrante.
+    """
+    if not key.startswith(EMAIL_PREFIX):
+        logger.info(f"Objeto fuera de {EMAIL_PREFIX}, se ignora: {key}")
+        return None
+    return TriageRecord(
+        record_id or key,
+        bucket,
+        key,
+        source,
+        key.rpartition("/")[2],
+        event_time,
+        sqs_attributes,
+    )
+
+
+def s3_notification_records(records, source, record_id=None, sqs_attributes=None):
+    adapted = []
+    for record in records:
+        if not record.get("eventName", "").startswith("ObjectCreated"):
+            continue
+        s3_info = record["s3"]
+        adapted.append(
+            from_s3_object(
+                s3_info["bucket"]["name"],
+                unquote_plus(s3_info["object"]["key"]),
+                record.get("eventTime"),
+                record_id,
+                source,
+                sqs_attributes,
+            )
+        )
+    return [record for record in adapted if record is not None]
+
+
+def sqs_records(record):
+    """
+    Registros de un mensaje SQS.
+    """
+    record_id = record.get("messageId")
+    attributes = record.get("attributes", {})
+    body = json.loads(record.get("body", "{}"))
+    if body.get("Type") == "Notification" and "Message" in body:
+        # Suscripción SNS sin entrega en crudo
+        body = json.loads(body["Message"])
+    if "Records" in body:
+        return s3_notification_records(body["Records"], "sqs", record_id, attributes)
+    if body.get("Event") == "s3:TestEvent":
+        return []
+    return [from_ses_notification(body, record_id, "sqs", attributes)]
+
+
+def adapt_event(event):
+    """
+    Devuelve (origen, lista de TriageRecord) de un evento de Lambda.
+    """
+    if event.get("source") == "aws.s3":
+        detail = event.get("detail", {})
+        record = from_s3_object(
+            detail.get("bucket", {}).get("name"),
+            detail.get("object", {}).get("key", ""),
+            event.get("time"),
+            event.get("id"),
+            "eventbridge",
+        )
+        return "eventbridge", [record] if record else []
+
+    records = event.get("Records", [])
+    sources = {r.get("eventSource") or r.get("EventSource") for r in records}
+    if sources == {"aws:s3"}:
+        return "s3", s3_notification_records(records, "s3")
+    if sources == {"aws:ses"}:
+        return "ses", [
+            from_ses_notification(r["ses"], r["ses"]["mail"]["messageId"], "ses")
+            for r in records
+        ]
+    return "sqs", [triage for r in records for triage in sqs_records(r)]
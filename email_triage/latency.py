@@ -0,0 +1,44 @@
+"""
+Latencia de extremo a extremo de cada email, desde que SES lo recibe hasta
+que se envía a la cola del agente, desglosada por tramos:
+
+- ses_to_queue: recepción en SES -> S3 -> SNS -> entrada en email-triage-queue
+  (SentTimestamp del mensaje SQS).
+- queue_wait: espera en email-triage-queue hasta la primera entrega
+  (ApproximateFirstReceiveTimestamp).
+- handling: desde la primera entrega hasta el envío al agente (incluye los
+  reintentos si el mensaje se ha entregado más de una vez).
+"""
+from datetime import datetime
+
+
+def parse_timestamp(value):
+    """
+    Convierte un timestamp ISO 8601 de SES ("2024-05-01T10:00:00.123Z") a
+    milisegundos desde epoch. None si no se puede interpretar.
+    """
+    try:
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    return int(moment.timestamp() * 1000)
+
+
+def hop_latencies(receipt_time, sqs_attributes, forwarded_at_ms):
+    """
+    Devuelve los tramos en milisegundos (ver el docstring del módulo), sin
+    los que no se pueden calcular por faltar algún timestamp.
+    """
+    received_at = parse_timestamp(receipt_time)
+    if received_at is None:
+        return {}
+    latencies = {"total": forwarded_at_ms - received_at}
+    sent_at = sqs_attributes.get("SentTimestamp")
+    first_receive_at = sqs_attributes.get("ApproximateFirstReceiveTimestamp")
+    if sent_at:
+        latencies["ses_to_queue"] = int(sent_at) - received_at
+    if sent_at and first_receive_at:
+        latencies["queue_wait"] = int(first_receive_at) - int(sent_at)
+    if first_receive_at:
+        latencies["handling"] = forwarded_at_ms - int(first_receive_at)
+    return latencies
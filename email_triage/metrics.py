@@ -0,0 +1,41 @@
+"""
+Métricas en CloudWatch mediante Embedded Metric Format (EMF): cada métrica es
+una línea JSON en el log que CloudWatch convierte en métrica, sin llamadas
+adicionales a la API.
+"""
+import json
+import time
+
+NAMESPACE = "EmailTriage"
+
+
+def emit_metric(name, value, unit="Count", dimensions=None, **properties):
+    """
+    Escribe una métrica EMF en stdout. Las `properties` se guardan en el log
+    (consultables con Logs Insights) pero no generan dimensiones.
+    """
+    emit_metrics({name: value}, unit, dimensions, **properties)
+
+
+def emit_metrics(values, unit="Count", dimensions=None, **properties):
+    """
+    Como emit_metric, pero con varias métricas de la misma unidad en una sola
+    línea de log.
+    """
+    dimensions = dimensions or {}
+    document = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": NAMESPACE,
+                    "Dimensions": [list(dimensions)],
+                    "Metrics": [{"Name": name, "Unit": unit} for name in values],
+                }
+            ],
+        },
+        **values,
+        **dimensions,
+        **properties,
+    }
+    print(json.dumps(document, default=str))
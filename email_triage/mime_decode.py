@@ -0,0 +1,306 @@
+"""
+Decodificación de texto MIME tolerante a charsets mal declarados.
+
+Muchos proveedores españoles envían Latin-1/Windows-1252 sin declarar el
+charset, o declarando UTF-8, y decodificar con el charset declarado y
+errors="replace" deja "�" en nombres y direcciones. decode_text prueba, en
+este orden y sin errores:
+
+1. el charset declarado (ISO-8859-1 se lee como Windows-1252, que es lo que
+   envían en la práctica), salvo que el texto sea UTF-8 válido;
+2. UTF-8;
+3. el charset aprendido para el remitente;
+4. el detector `charset_normalizer` si está instalado (dependencia opcional),
+   que ante un empate se queda con Windows-1252;
+5. Windows-1252 y, como último recurso, Latin-1 (nunca falla).
+
+El charset que funciona cuando el declarado no sirve se recuerda por
+remitente (LRU acotado), así que la detección solo se paga una vez.
+
+Para comparar con el parseo anterior (policy.default y errors="replace")
+sobre un corpus con charsets mezclados:
+
+    python mime_decode.py bench --count 2000
+"""
+import argparse
+import codecs
+import json
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from email import policy
+from email.header import decode_header, make_header
+from email.parser import BytesParser
+from email.utils import getaddresses
+
+try:
+    from charset_normalizer import from_bytes as detect_charset
+except ImportError:  # Dependencia opcional
+    detect_charset = None
+
+# Charsets que en la práctica son Windows-1252
+CHARSET_ALIASES = {
+    "ascii": "cp1252",
+    "us-ascii": "cp1252",
+    "latin-1": "cp1252",
+    "latin1": "cp1252",
+    "iso-8859-1": "cp1252",
+    "iso8859-1": "cp1252",
+}
+SINGLE_BYTE_CHARSETS = {"cp1252", "iso8859-15", "iso8859-1", "latin-1"}
+MAX_LEARNED_SENDERS = 10_000
+FOLDING = re.compile(r"\r?\n(?=[ \t])")
+
+
+class CharsetCache:
+    """
+    Charset aprendido por remitente, con expulsión LRU.
+    """
+
+    def __init__(self, max_size=MAX_LEARNED_SENDERS):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.charsets = OrderedDict()
+
+    def get(self, sender):
+        with self.lock:
+            charset = self.charsets.get(sender)
+            if charset is not None:
+                self.charsets.move_to_end(sender)
+            return charset
+
+    def learn(self, sender, charset):
+        with self.lock:
+            self.charsets[sender] = charset
+            self.charsets.move_to_end(sender)
+            if len(self.charsets) > self.max_size:
+                self.charsets.popitem(last=False)
+
+
+LEARNED_CHARSETS = CharsetCache()
+
+
+def normalize_charset(charset):
+    """
+    Nombre canónico del charset declarado, o None si no existe.
+    """
+    if not charset:
+        return None
+    charset = CHARSET_ALIASES.get(charset.strip().lower(), charset.strip().lower())
+    try:
+        return codecs.lookup(charset).name
+    except LookupError:
+        return None
+
+
+def try_decode(data, charset):
+    try:
+        return data.decode(charset)
+    except (UnicodeDecodeError, LookupError):
+        return None
+
+
+def detected_charset(data):
+    """
+    Charset más probable según charset_normalizer. Entre los candidatos que
+    empatan con el mejor se prefiere Windows-1252: con pocos bytes de 8 bits
+    el detector no distingue un texto español de uno en cp1250 o cp1254.
+    """
+    matches = detect_charset(data)
+    best = matches.best()
+    if best is None:
+        return None
+    for match in matches:
+        tied = (match.chaos, match.coherence) == (best.chaos, best.coherence)
+        if tied and "cp1252" in match.could_be_from_charset:
+            return "cp1252"
+    return normalize_charset(best.encoding)
+
+
+def decode_text(data, declared_charset=None, sender=None):
+    """
+    Decodifica `data` según el orden descrito en el módulo. `sender` (email
+    del remitente) activa el charset aprendido.
+    """
+    if not data:
+        return ""
+    if data.isascii():
+        return data.decode("ascii")
+
+    declared = normalize_charset(declared_charset)
+    if declared:
+        if declared in SINGLE_BYTE_CHARSETS:
+            # Un texto UTF-8 válido no es Latin-1 real
+            text = try_decode(data, "utf-8")
+            if text is not None:
+                return text
+        text = try_decode(data, declared)
+        if text is not None:
+            return text
+
+    text = try_decode(data, "utf-8")
+    if text is not None:
+        return text
+
+    learned = LEARNED_CHARSETS.get(sender) if sender else None
+    if learned:
+        text = try_decode(data, learned)
+        if text is not None:
+            return text
+
+    charset = None
+    if detect_charset is not None:
+        charset = detected_charset(data)
+    for candidate in (charset, "cp1252", "latin-1"):
+        if candidate:
+            text = try_decode(data, candidate)
+            if text is not None:
+                if sender:
+                    LEARNED_CHARSETS.learn(sender, candidate)
+                return text
+
+
+def decode_header_value(value, sender=None):
+    """
+    Header de un mensaje parseado con compat32 como texto: une las líneas
+    plegadas, decodifica las encoded-words (RFC 2047) y los bytes de 8 bits
+    sin declarar.
+    """
+    if value is None:
+        return ""
+    value = FOLDING.sub("", value)
+    try:
+        raw = value.encode("ascii", "surrogateescape")
+    except UnicodeEncodeError:
+        raw = None
+    if raw is not None and not raw.isascii():
+        # Header con bytes de 8 bits (sin encoded-words)
+        return decode_text(raw, None, sender)
+    if "=?" not in value:
+        return value
+    try:
+        return str(make_header(decode_header(value)))
+    except (UnicodeDecodeError, LookupError, ValueError):
+        return value
+
+
+def raw_headers(msg):
+    """
+    Headers sin procesar del mensaje, por nombre en minúsculas.
+    """
+    headers = {}
+    for name, value in msg.raw_items():
+        headers.setdefault(name.lower(), []).append(value)
+    return headers
+
+
+def decode_addresses(values, sender=None):
+    """
+    Lista de (nombre, email) con los nombres decodificados.
+    """
+    return [
+        (decode_header_value(name, sender), address)
+        for name, address in getaddresses(values)
+    ]
+
+
+def parse_message(raw_email):
+    """
+    Parseo ligero con compat32: no construye los objetos del registro de
+    headers de policy.default para cada header.
+    """
+    return BytesParser(policy=policy.compat32).parsebytes(raw_email)
+
+
+def legacy_parse(raw_email):
+    """
+    Parseo anterior (policy.default y errors="replace"), solo para la medición.
+    """
+    msg = BytesParser(policy=policy.default).parsebytes(raw_email)
+    body = {"plain": "", "html": ""}
+    for part in msg.walk():
+        content_type = part.get_content_type()
+        if content_type in ("text/plain", "text/html"):
+            body[content_type[5:]] += part.get_payload(decode=True).decode(
+                part.get_content_charset() or "utf-8", errors="replace"
+            )
+    return {"subject": msg.get("Subject", ""), "body": body}
+
+
+def mislabel(raw_email, rng):
+    """
+    Reproduce los fallos habituales: quita el charset declarado o declara
+    UTF-8 en partes que no lo son.
+    """
+    mode = rng.choice(["keep", "drop", "utf-8"])
+    if mode == "drop":
+        return re.sub(rb';\s*charset="?[\w-]+"?', b"", raw_email)
+    if mode == "utf-8":
+        return re.sub(
+            rb'charset="?(iso-8859-1|windows-1252)"?', b'charset="utf-8"', raw_email
+        )
+    return raw_email
+
+
+def cp1252_email(index):
+    """
+    Email en Windows-1252 real y 8bit, con bytes que no existen en Latin-1
+    ("€" es 0x80 y "’" es 0x92), como los que envían algunos proveedores.
+    """
+    text = (
+        f"Reserva nº {index}: 2 adultos, total 45,00 €.\r\n"
+        "Recuerde que el punto de encuentro está en el muelle ’Los Gigantes’.\r\n"
+    )
+    headers = (
+        "From: reservas@proveedor-ejemplo.es\r\n"
+        f"Subject: Reserva {index}\r\n"
+        "MIME-Version: 1.0\r\n"
+        'Content-Type: text/plain; charset="windows-1252"\r\n'
+        "Content-Transfer-Encoding: 8bit\r\n\r\n"
+    )
+    return headers.encode("ascii") + text.encode("cp1252")
+
+
+def bench(count, seed):
+    """
+    Mide el parseo anterior y el nuevo sobre un corpus sintético con charsets
+    mezclados y mal declarados, y cuenta los caracteres de sustitución.
+    """
+    from email_utils import parse_email_bytes
+    from synthetic_corpus import generate_email
+
+    rng = random.Random(seed)
+    # Uno de cada diez emails es el de Windows-1252 en 8bit
+    corpus = [
+        mislabel(cp1252_email(i) if i % 10 == 9 else generate_email(seed, i)[2], rng)
+        for i in range(count)
+    ]
+    results = {"emails": count}
+    for name, parse in (("legacy", legacy_parse), ("lean", parse_email_bytes)):
+        start = time.perf_counter()
+        parsed = [parse(raw_email) for raw_email in corpus]
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            "emails_per_sec": round(count / elapsed),
+            "replacement_chars": sum(
+                (p["body"]["plain"] + p["body"]["html"]).count("�")
+                for p in parsed
+            ),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decodificación MIME")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sub = subparsers.add_parser("bench")
+    sub.add_argument("--count", type=int, default=2000)
+    sub.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    print(json.dumps(bench(args.count, args.seed), indent=2))
+
+
+if __name__ == "__main__":
+    main()
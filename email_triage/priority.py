@@ -0,0 +1,110 @@
+"""
+Extracción de la fecha de la actividad (travel date) de los emails de
+reserva y clase de prioridad, para atender antes las reservas más próximas.
+"""
+import os
+import re
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+
+TIMEZONE = ZoneInfo(os.getenv("TRIAGE_TIMEZONE", "Atlantic/Canary"))
+
+# Clases de prioridad
+URGENT = "urgent"
+NORMAL = "normal"
+LOW = "low"
+
+MONTH_NAMES = {
+    1: ("jan", "january", "ene", "enero"),
+    2: ("feb", "february", "febrero"),
+    3: ("mar", "march", "marzo"),
+    4: ("apr", "april", "abr", "abril"),
+    5: ("may", "mayo"),
+    6: ("jun", "june", "junio"),
+    7: ("jul", "july", "julio"),
+    8: ("aug", "august", "ago", "agosto"),
+    9: ("sep", "sept", "september", "septiembre"),
+    10: ("oct", "october", "octubre"),
+    11: ("nov", "november", "noviembre"),
+    12: ("dec", "december", "dic", "diciembre"),
+}
+MONTHS = {name: number for number, names in MONTH_NAMES.items() for name in names}
+
+LABEL = (
+    r"(?:travel\s+date|tour\s+date|activity\s+date|date\s+of\s+travel|"
+    r"fecha\s+de\s+(?:la\s+)?(?:actividad|excursi[óo]n|experiencia)|"
+    r"fecha\s+del\s+(?:tour|servicio)|fecha)"
+)
+DATE_PATTERNS = [
+    # Sat, Dec 07, 2024 / Dec 7 2024
+    re.compile(
+        LABEL + r"\s*:?\s*(?:[A-Za-zé]+\.?,?\s+)?(?P<month>[A-Za-z]{3,10})\.?\s+"
+        r"(?P<day>\d{1,2}),?\s+(?P<year>\d{4})",
+        re.IGNORECASE,
+    ),
+    # 7 December 2024 / sábado, 7 de diciembre de 2024
+    re.compile(
+        LABEL + r"\s*:?\s*(?:[A-Za-záé]+\.?,?\s+)?(?P<day>\d{1,2})\.?\s+(?:de\s+)?"
+        r"(?P<month>[A-Za-z]{3,10})\.?,?\s+(?:de\s+)?(?P<year>\d{4})",
+        re.IGNORECASE,
+    ),
+    # 2024-12-07
+    re.compile(
+        LABEL + r"\s*:?\s*(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})",
+        re.IGNORECASE,
+    ),
+    # 07/12/2024 (día/mes/año)
+    re.compile(
+        LABEL + r"\s*:?\s*(?:[A-Za-záé]+\.?,?\s+)?"
+        r"(?P<day>\d{1,2})[/.-](?P<month>\d{1,2})[/.-](?P<year>\d{4})",
+        re.IGNORECASE,
+    ),
+]
+
+
+def extract_travel_date(text):
+    """
+    Busca la fecha de la actividad junto a su etiqueta (Travel Date, Fecha...)
+    y la devuelve como date, o None si no se encuentra.
+    """
+    for pattern in DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            month = match.group("month")
+            month = int(month) if month.isdigit() else MONTHS.get(month.lower())
+            if not month:
+                continue
+            try:
+                return date(int(match.group("year")), month, int(match.group("day")))
+            except ValueError:
+                continue
+    return None
+
+
+def today():
+    return datetime.now(TIMEZONE).date()
+
+
+def days_until_travel(text, reference_day=None):
+    """
+    Días que faltan para la actividad (negativo si ya pasó) o None si el
+    email no tiene fecha.
+    """
+    travel_date = extract_travel_date(text)
+    if travel_date is None:
+        return None
+    return (travel_date - (reference_day or today())).days
+
+
+def priority_class(days, urgent_days=1, low_priority_days=30):
+    """
+    URGENT si la actividad es hoy o en los próximos `urgent_days` días, LOW
+    si falta más de `low_priority_days` y NORMAL en el resto de casos (también
+    sin fecha o con la fecha ya pasada, que suelen ser cambios posteriores).
+    """
+    if days is None or days < 0:
+        return NORMAL
+    if days <= urgent_days:
+        return URGENT
+    if days > low_priority_days:
+        return LOW
+    return NORMAL
@@ -0,0 +1,57 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Limitador de tasa tipo token bucket, seguro entre hilos.
+    Permite como máximo `rate` operaciones por segundo con ráfagas de hasta
+    `burst` operaciones. Con rate <= 0 no limita.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate or 0)
+        self.capacity = float(burst or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        """
+        Bloquea hasta que haya `tokens` disponibles y los consume. Si se piden
+        más que la capacidad del bucket se consumen por partes.
+        """
+        if self.rate <= 0:
+            return
+        while tokens > self.capacity:
+            self.acquire(self.capacity)
+            tokens -= self.capacity
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def try_acquire(self, tokens=1):
+        """
+        Consume `tokens` si están disponibles sin bloquear. Devuelve si se han
+        podido consumir (nunca si se piden más que la capacidad).
+        """
+        if self.rate <= 0:
+            return True
+        with self.lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
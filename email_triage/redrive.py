@@ -0,0 +1,338 @@
+"""
+Herramienta de redrive para las DLQ (email-triage-dlq y
+email-to-be-processed-dlq). Vacía la DLQ en lotes de 10 con long polling y:
+
+- modo "send": reinyecta los mensajes en la cola destino con SendMessageBatch.
+- modo "process": ejecuta directamente el triaje (solo para email-triage-dlq).
+
+Uso:
+    python email_triage/redrive.py --dlq-url <url> --mode send \
+        --target-queue-url <url> --rate 20 --workers 4 [--dry-run]
+"""
+import argparse
+import json
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from app import (
+    load_valid_emails,
+    process_and_audit,
+    sqs,
+    AUDIT_LOG,
+    DISCARDED,
+    DUPLICATE,
+    FORWARDED,
+    THROTTLED,
+)
+from events import sqs_records
+from rate_limit import RateLimiter
+from resilience import call
+from worker import to_lambda_record
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+MAX_BATCH = 10
+WAIT_TIME_SECONDS = 20
+# En dry-run los mensajes se retienen invisibles hasta el final del recorrido
+DRY_RUN_VISIBILITY_TIMEOUT = 900
+
+
+class RedriveSummary:
+    """
+    Contadores compartidos entre hilos con el resultado del redrive y las
+    causas de fallo.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.outcomes = Counter()
+        self.failures = Counter()
+        self.seen_ids = set()
+
+    def first_seen(self, message_id):
+        with self.lock:
+            if message_id in self.seen_ids:
+                return False
+            self.seen_ids.add(message_id)
+            return True
+
+    def add(self, outcome, cause=None):
+        with self.lock:
+            self.outcomes[outcome] += 1
+            if cause:
+                self.failures[cause] += 1
+
+    def as_dict(self):
+        with self.lock:
+            return {"outcomes": dict(self.outcomes), "failures": dict(self.failures)}
+
+
+def receive_batch(dlq_url, visibility_timeout=None):
+    """
+    Recibe hasta 10 mensajes de la DLQ con long polling.
+    """
+    params = {
+        "QueueUrl": dlq_url,
+        "MaxNumberOfMessages": MAX_BATCH,
+        "WaitTimeSeconds": WAIT_TIME_SECONDS,
+        "MessageAttributeNames": ["All"],
+        "AttributeNames": ["ApproximateReceiveCount"],
+    }
+    if visibility_timeout is not None:
+        params["VisibilityTimeout"] = visibility_timeout
+    return call("sqs", sqs.receive_message, **params).get("Messages", [])
+
+
+def delete_batch(dlq_url, messages):
+    """
+    Borra de la DLQ los mensajes ya reinyectados.
+    """
+    if not messages:
+        return
+    response = call(
+        "sqs",
+        sqs.delete_message_batch,
+        QueueUrl=dlq_url,
+        Entries=[
+            {"Id": str(i), "ReceiptHandle": m["ReceiptHandle"]}
+            for i, m in enumerate(messages)
+        ],
+    )
+    for failed in response.get("Failed", []):
+        logger.error(f"No se pudo borrar el mensaje de la DLQ: {failed}")
+
+
+def release_batch(dlq_url, messages):
+    """
+    Devuelve los mensajes a la DLQ (visibilidad 0) tras un dry-run.
+    """
+    if not messages:
+        return
+    call(
+        "sqs",
+        sqs.change_message_visibility_batch,
+        QueueUrl=dlq_url,
+        Entries=[
+            {
+                "Id": str(i),
+                "ReceiptHandle": m["ReceiptHandle"],
+                "VisibilityTimeout": 0,
+            }
+            for i, m in enumerate(messages)
+        ],
+    )
+
+
+def message_records(message):
+    """
+    TriageRecord del mensaje, con los mismos adaptadores que lambda_handler
+    (notificación de SES, sobre de SNS o notificación de S3).
+    """
+    return sqs_records(to_lambda_record(message))
+
+
+def classify_message(message):
+    """
+    Diagnostica un mensaje de email-triage-dlq sin procesarlo. Devuelve None si
+    parece válido o la causa probable del fallo.
+    """
+    try:
+        records = message_records(message)
+    except (ValueError, AttributeError, KeyError, TypeError):
+        return "invalid_json"
+    if not records:
+        return "no_email_records"
+    if any(not r.bucket or not r.key for r in records):
+        return "missing_s3_location"
+    return None
+
+
+def send_batch(target_queue_url, messages, summary):
+    """
+    Reinyecta un lote en la cola destino y devuelve los mensajes enviados con
+    éxito (los únicos que se deben borrar de la DLQ).
+    """
+    entries = []
+    for i, m in enumerate(messages):
+        entry = {"Id": str(i), "MessageBody": m["Body"]}
+        if m.get("MessageAttributes"):
+            entry["MessageAttributes"] = m["MessageAttributes"]
+        entries.append(entry)
+    try:
+        response = call(
+            "sqs", sqs.send_message_batch, QueueUrl=target_queue_url, Entries=entries
+        )
+    except Exception as e:
+        logger.exception("Error en SendMessageBatch")
+        for _ in messages:
+            summary.add("failed", type(e).__name__)
+        return []
+
+    for failed in response.get("Failed", []):
+        summary.add("failed", failed.get("Code", "unknown"))
+    sent = [messages[int(ok["Id"])] for ok in response.get("Successful", [])]
+    for _ in sent:
+        summary.add("redriven")
+    return sent
+
+
+def process_batch(messages, valid_emails, rate_limiter, summary):
+    """
+    Ejecuta el triaje directamente sobre cada mensaje del lote y devuelve los
+    mensajes procesados (reenviados, descartados, retenidos o duplicados).
+    """
+    done = []
+    for m in messages:
+        cause = classify_message(m)
+        if cause:
+            summary.add("failed", cause)
+            continue
+        processed = True
+        for record in message_records(m):
+            try:
+                result = process_and_audit(
+                    "redrive",
+                    record.bucket,
+                    record.key,
+                    valid_emails,
+                    rate_limiter,
+                    ses_receipt=(record.ses_message_id, record.receipt_time),
+                    sender_limit=False,
+                )
+            except Exception as e:
+                logger.exception(f"Error procesando {record.key}")
+                summary.add("failed", type(e).__name__)
+                processed = False
+                continue
+            if result in (FORWARDED, DISCARDED, THROTTLED, DUPLICATE):
+                summary.add(result)
+            else:
+                summary.add("failed", "process_email_failed")
+                processed = False
+        # Solo se borra de la DLQ si se han procesado todos sus emails
+        if processed:
+            done.append(m)
+    if AUDIT_LOG is not None:
+        AUDIT_LOG.flush()
+    return done
+
+
+def drain(
+    dlq_url,
+    mode,
+    target_queue_url,
+    rate_limiter,
+    summary,
+    dry_run,
+    max_messages,
+    valid_emails,
+):
+    """
+    Bucle de un hilo: recibe lotes hasta que la DLQ queda vacía o se alcanza
+    max_messages. En dry-run devuelve los mensajes retenidos para liberarlos
+    al final.
+    """
+    held = []
+    seen = 0
+    visibility_timeout = DRY_RUN_VISIBILITY_TIMEOUT if dry_run else None
+    while not max_messages or seen < max_messages:
+        messages = receive_batch(dlq_url, visibility_timeout)
+        if not messages:
+            return held
+        seen += len(messages)
+
+        if dry_run:
+            held.extend(messages)
+            for m in messages:
+                if not summary.first_seen(m["MessageId"]):
+                    continue
+                cause = classify_message(m) if mode == "process" else None
+                summary.add("would_fail" if cause else "would_redrive", cause)
+            continue
+
+        if mode == "send":
+            rate_limiter.acquire(len(messages))
+            done = send_batch(target_queue_url, messages, summary)
+        else:
+            done = process_batch(messages, valid_emails, rate_limiter, summary)
+        delete_batch(dlq_url, done)
+    return held
+
+
+def run_redrive(
+    dlq_url,
+    mode="send",
+    target_queue_url=None,
+    rate=10,
+    workers=4,
+    dry_run=False,
+    max_messages=0,
+):
+    """
+    Vacía la DLQ con `workers` hilos concurrentes limitados a `rate` mensajes
+    por segundo y devuelve el resumen de resultados y causas de fallo.
+    """
+    if mode == "send" and not target_queue_url:
+        raise ValueError("El modo send necesita --target-queue-url")
+
+    summary = RedriveSummary()
+    # Ráfaga de al menos un lote para poder enviar lotes completos con --rate < 10
+    rate_limiter = RateLimiter(rate, burst=max(rate, MAX_BATCH))
+    valid_emails = None
+    if mode == "process" and not dry_run:
+        valid_emails = load_valid_emails()
+        if valid_emails is None:
+            raise RuntimeError("La lista de emails válidos no está disponible")
+    per_worker = -(-max_messages // workers) if max_messages else 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                drain,
+                dlq_url,
+                mode,
+                target_queue_url,
+                rate_limiter,
+                summary,
+                dry_run,
+                per_worker,
+                valid_emails,
+            )
+            for _ in range(workers)
+        ]
+        held = [m for future in futures for m in future.result()]
+
+    for i in range(0, len(held), MAX_BATCH):
+        release_batch(dlq_url, held[i : i + MAX_BATCH])
+
+    return summary.as_dict()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Redrive de las DLQ del triaje")
+    parser.add_argument("--dlq-url", required=True)
+    parser.add_argument("--mode", choices=["send", "process"], default="send")
+    parser.add_argument("--target-queue-url")
+    parser.add_argument("--rate", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-messages", type=int, default=0)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    summary = run_redrive(
+        args.dlq_url,
+        args.mode,
+        args.target_queue_url,
+        args.rate,
+        args.workers,
+        args.dry_run,
+        args.max_messages,
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
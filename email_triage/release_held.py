@@ -0,0 +1,107 @@
+"""
+Libera los emails retenidos por el límite por remitente (retenidos/): los
+vuelve a pasar por el triaje sin ese límite, a `rate` mensajes por segundo, y
+los saca de retenidos/ según el resultado (a emails/ si se han enviado al
+agente, a no_relevante/ o duplicados/ si no). Los que fallan se quedan en
+retenidos/ para la siguiente ejecución.
+
+Uso:
+    python email_triage/release_held.py --bucket booking-automation-email-test \
+        --workers 4 --rate 5
+"""
+import argparse
+import json
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from app import (
+    load_valid_emails,
+    move_email_to_prefix,
+    process_and_audit,
+    AUDIT_LOG,
+    DISCARDED,
+    DUPLICATE,
+    DUPLICATE_PREFIX,
+    FAILED,
+    FORWARDED,
+    HOLDING_PREFIX,
+)
+from backfill import iter_key_pages
+from rate_limit import RateLimiter
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Carpeta a la que vuelve cada email según el resultado del triaje
+DESTINATION_BY_RESULT = {
+    FORWARDED: "emails/",
+    DISCARDED: "no_relevante/",
+    DUPLICATE: DUPLICATE_PREFIX,
+}
+
+
+def release_email(bucket, key, valid_emails, rate_limiter):
+    try:
+        result = process_and_audit(
+            "release", bucket, key, valid_emails, rate_limiter, sender_limit=False
+        )
+    except Exception:
+        logger.exception(f"Error liberando {key}")
+        return FAILED
+    if result in DESTINATION_BY_RESULT:
+        move_email_to_prefix(
+            bucket, key, DESTINATION_BY_RESULT[result], from_prefix=HOLDING_PREFIX
+        )
+    return result
+
+
+def run_release(bucket, workers=4, rate=5, max_emails=0):
+    """
+    Libera los emails de retenidos/ (como mucho `max_emails`, 0 = todos) y
+    devuelve los contadores por resultado.
+    """
+    valid_emails = load_valid_emails()
+    if valid_emails is None:
+        raise RuntimeError("La lista de emails válidos no está disponible")
+    rate_limiter = RateLimiter(rate)
+    counts = Counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for keys in iter_key_pages(bucket, HOLDING_PREFIX):
+            if max_emails:
+                keys = keys[: max_emails - sum(counts.values())]
+            counts.update(
+                executor.map(
+                    lambda key: release_email(bucket, key, valid_emails, rate_limiter),
+                    keys,
+                )
+            )
+            if AUDIT_LOG is not None:
+                AUDIT_LOG.flush()
+            logger.info(f"Liberados hasta {keys[-1]}: {dict(counts)}")
+            if max_emails and sum(counts.values()) >= max_emails:
+                break
+    return dict(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Libera los emails retenidos")
+    parser.add_argument("--bucket", required=True)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=5,
+        help="Mensajes SQS por segundo (0 = sin límite)",
+    )
+    parser.add_argument(
+        "--max-emails", type=int, default=0, help="Máximo de emails (0 = todos)"
+    )
+    args = parser.parse_args()
+
+    counts = run_release(args.bucket, args.workers, args.rate, args.max_emails)
+    print(json.dumps(counts))
+
+
+if __name__ == "__main__":
+    main()
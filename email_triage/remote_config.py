@@ -0,0 +1,163 @@
+"""
+Configuración remota del triaje: umbrales, colas, tabla de emails y tabla de
+rutas en un documento JSON versionado que se puede cambiar sin redesplegar.
+
+    {
+        "version": 12,
+        "settings": {"sender_limit_per_minute": 120, "duplicate_action": "flag"},
+        "routing": {"default_queue_url": "...", "routes": [...]}
+    }
+
+El documento se lee de S3 (`s3://bucket/key`), de un parámetro de SSM
+(`ssm:/nombre`) o de un fichero local (cualquier otra ruta). Cada contenedor
+lo guarda en caché y lo vuelve a comprobar como mucho cada `ttl_seconds`, con
+una lectura condicional (ETag en S3, versión del parámetro en SSM, fecha de
+modificación del fichero), así que normalmente la comprobación no descarga
+nada. Si el contenido ha cambiado (haya cambiado o no `version`, que solo se
+usa en los logs) se compila entero (reglas, Router) y se sustituye de una
+vez; si la descarga o la compilación fallan se mantiene la última
+configuración válida y se vuelve a intentar en la siguiente comprobación.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from resilience import call
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+class S3ConfigSource:
+    def __init__(self, s3_client, bucket, key):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.key = key
+
+    def fetch(self, etag=None):
+        """
+        Devuelve (documento, etag) o None si no ha cambiado desde `etag`.
+        """
+        params = {"Bucket": self.bucket, "Key": self.key}
+        if etag:
+            params["IfNoneMatch"] = etag
+        try:
+            response = call("s3", self.s3.get_object, **params)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("304", "NotModified"):
+                return None
+            raise
+        return json.loads(response["Body"].read()), response["ETag"]
+
+
+class SsmConfigSource:
+    def __init__(self, ssm_client, name):
+        self.ssm = ssm_client
+        self.name = name
+
+    def fetch(self, etag=None):
+        parameter = call("ssm", self.ssm.get_parameter, Name=self.name)["Parameter"]
+        version = str(parameter["Version"])
+        if version == etag:
+            return None
+        return json.loads(parameter["Value"]), version
+
+
+class FileConfigSource:
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self, etag=None):
+        stat = os.stat(self.path)
+        version = f"{stat.st_mtime_ns}:{stat.st_size}"
+        if version == etag:
+            return None
+        with open(self.path) as f:
+            return json.load(f), version
+
+
+def content_digest(document):
+    """
+    Huella del contenido del documento, independiente del orden de las claves.
+    """
+    canonical = json.dumps(document, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ConfigProvider:
+    """
+    Mantiene la configuración compilada por `compile_config` a partir del
+    último documento válido.
+    """
+
+    def __init__(self, source, compile_config, ttl_seconds=60):
+        self.source = source
+        self.compile_config = compile_config
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.checked_at = None
+        self.etag = None
+        self.digest = None
+        self.version = None
+        self.current = None
+
+    def refresh(self, force=False):
+        """
+        Comprueba si hay una versión nueva (si ha vencido el TTL o con
+        `force`) y devuelve la configuración compilada vigente, o None si
+        todavía no se ha podido cargar ninguna.
+        """
+        now = time.monotonic()
+        checked_at = self.checked_at
+        if not force and checked_at is not None and now - checked_at < self.ttl_seconds:
+            return self.current
+        # Si otro hilo ya está comprobando, se sigue con la configuración vigente
+        if not self.lock.acquire(blocking=False):
+            return self.current
+        try:
+            fetched = self.source.fetch(self.etag)
+            if fetched is not None:
+                document, etag = fetched
+                digest = content_digest(document)
+                if digest != self.digest or self.current is None:
+                    self.current = self.compile_config(document)
+                    self.digest = digest
+                    self.version = document.get("version")
+                    logger.info(
+                        f"Configuración remota en la versión {self.version} "
+                        f"({digest[:12]})"
+                    )
+                self.etag = etag
+        except Exception:
+            logger.exception("Error al cargar la configuración remota")
+        finally:
+            self.checked_at = now
+            self.lock.release()
+        return self.current
+
+
+def load_config_source(uri, s3_client):
+    """
+    Crea la fuente de configuración a partir de CONFIG_SOURCE, o None si no
+    hay ninguna configurada.
+    """
+    if not uri:
+        return None
+    if uri.startswith("s3://"):
+        bucket, _, key = uri[len("s3://") :].partition("/")
+        return S3ConfigSource(s3_client, bucket, key)
+    if uri.startswith("ssm:"):
+        import boto3
+
+        from resilience import BOTO_CONFIG
+
+        from snapstart import recreatable
+
+        ssm_client = recreatable(lambda: boto3.client("ssm", config=BOTO_CONFIG))
+        return SsmConfigSource(ssm_client, uri[len("ssm:") :])
+    return FileConfigSource(uri)
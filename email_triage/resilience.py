@@ -0,0 +1,209 @@
+"""
+Capa de resiliencia para las llamadas a DynamoDB, S3, SQS y SSM.
+
+Cada dependencia tiene:
+- un circuit breaker: tras `failure_threshold` fallos seguidos deja de
+  llamarla durante `reset_timeout` segundos (falla rápido con
+  CircuitOpenError) y después deja pasar una llamada de prueba;
+- un presupuesto de reintentos: los reintentos se limitan a una fracción de
+  las llamadas recientes, para no multiplicar la carga durante una caída.
+
+Los reintentos usan backoff exponencial con jitter completo. Solo se
+reintentan (y cuentan como fallo) los errores transitorios. Los clientes de
+boto3 se crean con BOTO_CONFIG: sin reintentos propios (los hace esta capa)
+pero con el limitador de tasa adaptativo de botocore ante throttling.
+"""
+import logging
+import random
+import threading
+import time
+
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
+
+from metrics import emit_metric
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+RETRYABLE_ERROR_CODES = {
+    "InternalError",
+    "InternalFailure",
+    "ProvisionedThroughputExceededException",
+    "RequestLimitExceeded",
+    "RequestTimeout",
+    "ServiceUnavailable",
+    "SlowDown",
+    "Throttling",
+    "ThrottlingException",
+    "TooManyRequestsException",
+}
+
+
+BOTO_CONFIG = Config(retries={"mode": "adaptive", "max_attempts": 1})
+
+
+class CircuitOpenError(Exception):
+    """
+    La dependencia tiene el circuito abierto y no se ha llamado.
+    """
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def allow(self):
+        """
+        Devuelve si se puede llamar a la dependencia.
+        """
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self.probing = False
+            # Medio abierto: una sola llamada de prueba a la vez
+            if self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            if self.state != self.CLOSED:
+                logger.info(f"Circuito de {self.name} cerrado")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.failures >= self.failure_threshold
+            ):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                logger.error(
+                    f"Circuito de {self.name} abierto tras {self.failures} fallos"
+                )
+                emit_metric("CircuitOpened", 1, dimensions={"Dependency": self.name})
+
+
+class RetryBudget:
+    """
+    Cada llamada deposita `ratio` tokens y cada reintento gasta uno; siempre
+    hay al menos `min_tokens` disponibles al arrancar.
+    """
+
+    def __init__(self, ratio=0.2, min_tokens=5, max_tokens=50):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = float(min_tokens)
+        self.lock = threading.Lock()
+
+    def record_request(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self):
+        with self.lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+def is_retryable(error):
+    """
+    Errores transitorios: red, throttling y errores 5xx del servicio.
+    """
+    if isinstance(error, BotoCoreError):
+        return True
+    if isinstance(error, ClientError):
+        response = error.response
+        code = response.get("Error", {}).get("Code", "")
+        status = response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+        return code in RETRYABLE_ERROR_CODES or status >= 500
+    return False
+
+
+BREAKERS = {name: CircuitBreaker(name) for name in ("dynamodb", "s3", "sqs", "ssm")}
+BUDGETS = {name: RetryBudget() for name in BREAKERS}
+
+
+def reset_state():
+    """
+    Vuelve a cerrar los circuitos y a llenar los presupuestos de reintentos
+    (por ejemplo tras restaurar un snapshot de SnapStart).
+    """
+    for name in BREAKERS:
+        BREAKERS[name] = CircuitBreaker(name)
+        BUDGETS[name] = RetryBudget()
+
+
+def call(
+    dependency, fn, *args, max_attempts=3, base_delay=0.05, max_delay=1.0, **kwargs
+):
+    """
+    Llama a `fn(*args, **kwargs)` protegida por el circuit breaker y el
+    presupuesto de reintentos de `dependency`.
+    """
+    breaker = BREAKERS[dependency]
+    budget = BUDGETS[dependency]
+    if not breaker.allow():
+        raise CircuitOpenError(dependency)
+    budget.record_request()
+
+    attempt = 1
+    while True:
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if not is_retryable(e):
+                # La dependencia ha respondido: no cuenta como caída
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            if (
+                attempt >= max_attempts
+                or not budget.try_spend()
+                or not breaker.allow()
+            ):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2**attempt))
+            logger.warning(f"Reintentando llamada a {dependency} en {delay:.2f}s: {e}")
+            time.sleep(delay)
+            attempt += 1
+            continue
+        breaker.record_success()
+        return result
+
+
+def paginate(dependency, fn, token_param, next_token_field, **kwargs):
+    """
+    Recorre una operación paginada pidiendo cada página con call(). Sustituye a
+    los paginators de boto3, que con BOTO_CONFIG no reintentan ninguna página.
+    """
+    while True:
+        page = call(dependency, fn, **kwargs)
+        yield page
+        token = page.get(next_token_field)
+        if not token:
+            return
+        kwargs[token_param] = token
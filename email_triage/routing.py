@@ -0,0 +1,178 @@
+"""
+Enrutado de emails a varias colas del agente.
+
+La configuración (JSON) asigna colas por dirección de destinatario, dominio
+del remitente o código de producto encontrado en el email:
+
+    {
+        "default_queue_url": "https://sqs.../email-to-be-processed-queue-test",
+        "routes": [
+            {"recipient": "otro-operador@tripilots.com", "queue_url": "..."},
+            {"sender_domain": "viator.com", "queue_url": "..."},
+            {"product": "41935P336", "queue_url": "..."}
+        ]
+    }
+
+Prioridad: destinatario > dominio del remitente > producto > cola por defecto.
+Un email dirigido a varios operadores se envía a todas sus colas.
+"""
+import json
+import logging
+import threading
+import os
+import re
+from collections import defaultdict
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Límites de SendMessageBatch
+MAX_BATCH_ENTRIES = 10
+MAX_BATCH_BYTES = 256 * 1024
+
+
+class Router:
+    """
+    Índice precompilado de rutas: diccionarios por destinatario y dominio y
+    una única expresión regular con todos los códigos de producto.
+    """
+
+    def __init__(self, config, default_queue_url=None):
+        self.default_queue_url = config.get("default_queue_url") or default_queue_url
+        self.by_recipient = defaultdict(list)
+        self.by_domain = defaultdict(list)
+        self.by_product = defaultdict(list)
+        for route in config.get("routes", []):
+            queue_url = route["queue_url"]
+            if route.get("recipient"):
+                self.by_recipient[route["recipient"].strip().lower()].append(queue_url)
+            if route.get("sender_domain"):
+                self.by_domain[route["sender_domain"].strip().lower()].append(queue_url)
+            if route.get("product"):
+                self.by_product[route["product"].strip()].append(queue_url)
+
+        self.product_pattern = None
+        if self.by_product:
+            codes = sorted(self.by_product, key=len, reverse=True)
+            self.product_pattern = re.compile(
+                r"\b(" + "|".join(re.escape(code) for code in codes) + r")\b"
+            )
+
+    def _domain_queues(self, address):
+        # Se prueba el dominio y sus dominios padre (t1.viator.com -> viator.com)
+        labels = address.rpartition("@")[2].lower().split(".")
+        for i in range(len(labels) - 1):
+            queues = self.by_domain.get(".".join(labels[i:]))
+            if queues:
+                return queues
+        return []
+
+    def match(self, headers, combined_email):
+        """
+        Devuelve las colas (sin duplicados) a las que enviar el email y el tipo
+        de regla que ha decidido: "recipient", "sender_domain", "product",
+        "default" o None si no hay ninguna cola.
+        """
+        queues = []
+        for _, address in headers.get("to", []) + headers.get("cc", []):
+            queues.extend(self.by_recipient.get(address.strip().lower(), []))
+        if queues:
+            return list(dict.fromkeys(queues)), "recipient"
+        for _, address in headers.get("from", []):
+            queues.extend(self._domain_queues(address))
+        if queues:
+            return list(dict.fromkeys(queues)), "sender_domain"
+        if self.product_pattern:
+            for match in self.product_pattern.finditer(combined_email):
+                queues.extend(self.by_product[match.group(1)])
+        if queues:
+            return list(dict.fromkeys(queues)), "product"
+        if self.default_queue_url:
+            return [self.default_queue_url], "default"
+        return [], None
+
+    def route(self, headers, combined_email):
+        """
+        Devuelve la lista de colas (sin duplicados) a las que enviar el email.
+        """
+        return self.match(headers, combined_email)[0]
+
+
+def load_router(path, default_queue_url):
+    """
+    Carga la configuración de rutas desde `path`. Si no existe, todo se envía
+    a la cola por defecto.
+    """
+    config = {}
+    if path and os.path.exists(path):
+        with open(path) as f:
+            config = json.load(f)
+        logger.info(f"Configuración de rutas cargada desde {path}")
+    return Router(config, default_queue_url)
+
+
+class ForwardBatcher:
+    """
+    Acumula los mensajes a enviar agrupados por cola y los envía con
+    SendMessageBatch (máximo 10 mensajes y 256 KB por lote). Se puede llamar
+    a add() desde varios hilos.
+    """
+
+    def __init__(self, send_batch):
+        self.send_batch = send_batch
+        self.lock = threading.Lock()
+        self.pending = defaultdict(list)
+
+    def add(
+        self, queue_url, msg_attributes, msg_body, record_id=None, delay_seconds=0
+    ):
+        """
+        Añade un mensaje; `record_id` identifica el registro de origen en los
+        fallos devueltos por flush() y `delay_seconds` retrasa su entrega.
+        """
+        entry = {"MessageAttributes": msg_attributes, "MessageBody": msg_body}
+        if delay_seconds:
+            entry["DelaySeconds"] = delay_seconds
+        with self.lock:
+            self.pending[queue_url].append((entry, record_id))
+
+    def _chunks(self, entries):
+        chunk, size = [], 0
+        for entry, record_id in entries:
+            entry_size = len(entry["MessageBody"].encode("utf-8")) + len(
+                json.dumps(entry["MessageAttributes"])
+            )
+            if chunk and (
+                len(chunk) == MAX_BATCH_ENTRIES or size + entry_size > MAX_BATCH_BYTES
+            ):
+                yield chunk
+                chunk, size = [], 0
+            chunk.append((entry, record_id))
+            size += entry_size
+        if chunk:
+            yield chunk
+
+    def flush(self):
+        """
+        Envía todo lo pendiente y devuelve los record_id de los mensajes que
+        fallaron.
+        """
+        failed = []
+        with self.lock:
+            pending, self.pending = self.pending, defaultdict(list)
+        for queue_url, entries in pending.items():
+            for chunk in self._chunks(entries):
+                batch = [dict(entry, Id=str(i)) for i, (entry, _) in enumerate(chunk)]
+                try:
+                    response = self.send_batch(queue_url, batch)
+                except Exception:
+                    logger.exception(f"Error enviando lote a la cola {queue_url}")
+                    failed.extend(record_id for _, record_id in chunk)
+                    continue
+                for failure in response.get("Failed", []):
+                    logger.error(f"Mensaje no enviado a {queue_url}: {failure}")
+                    failed.append(chunk[int(failure["Id"])][1])
+                logger.info(
+                    f"Lote de {len(batch)} mensajes enviado a la cola {queue_url}"
+                )
+        return failed
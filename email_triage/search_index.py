@@ -0,0 +1,383 @@
+"""
+Índice de búsqueda local (SQLite FTS5) sobre los emails triados, para
+averiguar en menos de un segundo qué pasó con un email sin buscar en
+CloudWatch.
+
+Se indexan los emails de todas las carpetas del triaje (emails/,
+no_relevante/, archive/no_relevante/, retenidos/, duplicados/). El resultado
+se toma del registro de auditoría (ver audit.py), con la decisión más
+reciente de cada email, sea del triaje o de una herramienta de operación; la
+carpeta no basta, porque los emails reenviados por un backfill siguen en
+no_relevante/. Los emails sin registro de auditoría quedan como "unknown".
+Remitente y asunto se leen del email parseado en parsed/ si existe, o del
+original. La sincronización es incremental: solo se leen los objetos de
+auditoría y los emails nuevos o que han cambiado de carpeta.
+
+Uso:
+    AUDIT_BUCKET=<bucket> python email_triage/search_index.py sync \
+        --bucket <bucket> --db triage.db
+    python email_triage/search_index.py query --db triage.db "BR-1200722491"
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from audit import decode_records, load_audit_log
+from compaction import ARCHIVE_PREFIX, read_bundle_entry
+from duplicates import extract_booking_reference
+from email_utils import (
+    extract_sender,
+    parse_email_bytes,
+    parsed_cache_key,
+    read_parsed_cache,
+    s3,
+)
+from resilience import call, paginate
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+FOLDERS = ("emails/", "no_relevante/", "retenidos/", "duplicados/")
+
+# Resultados de process_email más "unknown" (sin registro de auditoría)
+DECISIONS = ("forwarded", "discarded", "throttled", "duplicate", "failed", "unknown")
+
+# Emails indexados entre commits de sync_prefix
+COMMIT_EVERY = 500
+AUDIT_DAY = re.compile(r"date=(\d{4}-\d{2}-\d{2})/")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS emails (
+    message_id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    etag TEXT,
+    decision TEXT NOT NULL,
+    sender TEXT,
+    subject TEXT,
+    booking_ref TEXT,
+    last_modified TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS emails_fts USING fts5(
+    key, sender, subject, booking_ref, decision,
+    content='emails', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS emails_ai AFTER INSERT ON emails BEGIN
+    INSERT INTO emails_fts(rowid, key, sender, subject, booking_ref, decision)
+    VALUES (new.rowid, new.key, new.sender, new.subject, new.booking_ref,
+            new.decision);
+END;
+CREATE TRIGGER IF NOT EXISTS emails_ad AFTER DELETE ON emails BEGIN
+    INSERT INTO emails_fts(emails_fts, rowid, key, sender, subject, booking_ref,
+                           decision)
+    VALUES ('delete', old.rowid, old.key, old.sender, old.subject,
+            old.booking_ref, old.decision);
+END;
+CREATE TRIGGER IF NOT EXISTS emails_au AFTER UPDATE ON emails BEGIN
+    INSERT INTO emails_fts(emails_fts, rowid, key, sender, subject, booking_ref,
+                           decision)
+    VALUES ('delete', old.rowid, old.key, old.sender, old.subject,
+            old.booking_ref, old.decision);
+    INSERT INTO emails_fts(rowid, key, sender, subject, booking_ref, decision)
+    VALUES (new.rowid, new.key, new.sender, new.subject, new.booking_ref,
+            new.decision);
+END;
+CREATE TABLE IF NOT EXISTS archive_indexes (key TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS decisions (
+    message_id TEXT PRIMARY KEY,
+    decision TEXT NOT NULL,
+    ts TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS audit_objects (key TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS sync_state (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+def connect(path):
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    return db
+
+
+def summarize(email_content):
+    """
+    Obtiene remitente, asunto y referencia de reserva de un email parseado.
+    """
+    headers = email_content["headers"]
+    body = email_content["body"]
+    from_emails = ", ".join(
+        f"{name} <{email}>" if name else email for name, email in headers["from"]
+    )
+    subject = headers.get("subject", "")
+    text = f"{subject}\n{body['plain'] or body['html']}"
+    return (
+        extract_sender(f"From: {from_emails}") or from_emails,
+        subject,
+        extract_booking_reference(text),
+    )
+
+
+def read_summary(bucket, key, etag):
+    """
+    Lee el email parseado de parsed/ o, si no existe, el original.
+    """
+    email_content = read_parsed_cache(bucket, parsed_cache_key(etag))
+    if not email_content:
+        raw_email = call("s3", s3.get_object, Bucket=bucket, Key=key)["Body"].read()
+        email_content = parse_email_bytes(raw_email)
+    return summarize(email_content)
+
+
+def decision_for(db, message_id):
+    row = db.execute(
+        "SELECT decision FROM decisions WHERE message_id = ?", (message_id,)
+    ).fetchone()
+    return row[0] if row else "unknown"
+
+
+def upsert(db, message_id, key, etag, summary, last_modified):
+    decision = decision_for(db, message_id)
+    sender, subject, booking_ref = summary
+    db.execute("DELETE FROM emails WHERE message_id = ?", (message_id,))
+    db.execute(
+        "INSERT INTO emails VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (message_id, key, etag, decision, sender, subject, booking_ref, last_modified),
+    )
+
+
+def list_pages(bucket, prefix):
+    return paginate(
+        "s3",
+        s3.list_objects_v2,
+        "ContinuationToken",
+        "NextContinuationToken",
+        Bucket=bucket,
+        Prefix=prefix,
+    )
+
+
+def pending_objects(db, bucket, prefix):
+    """
+    Lista el prefijo y devuelve los objetos que no están indexados con esa
+    misma clave y ETag.
+    """
+    for page in list_pages(bucket, prefix):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            if key.endswith("/"):
+                continue
+            row = db.execute(
+                "SELECT key, etag FROM emails WHERE message_id = ?",
+                (key.rpartition("/")[2],),
+            ).fetchone()
+            if row != (key, obj["ETag"]):
+                yield obj
+
+
+def sync_audit(db, bucket, sink):
+    """
+    Lee los objetos de auditoría nuevos y guarda la decisión más reciente de
+    cada email de `bucket`, actualizando los emails ya indexados.
+
+    Se guarda la última partición date= sincronizada y el listado empieza en
+    la anterior a esa (un flush justo después de medianoche aún escribe en el
+    día anterior); los objetos ya leídos de esas dos particiones se saltan.
+    """
+    row = db.execute("SELECT value FROM sync_state WHERE name = 'audit_day'").fetchone()
+    last_day = row[0] if row else ""
+    since = ""
+    if last_day:
+        since = (date.fromisoformat(last_day) - timedelta(days=1)).isoformat()
+    count = 0
+    for audit_key in sink.keys(since):
+        match = AUDIT_DAY.search(audit_key)
+        if match and match.group(1) > last_day:
+            last_day = match.group(1)
+            db.execute(
+                "INSERT INTO sync_state VALUES ('audit_day', ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                (last_day,),
+            )
+        if db.execute(
+            "SELECT 1 FROM audit_objects WHERE key = ?", (audit_key,)
+        ).fetchone():
+            continue
+        for record in decode_records(sink.read(audit_key)):
+            if (
+                record.get("bucket") != bucket
+                or not record.get("key")
+                or not record.get("result")
+            ):
+                continue
+            message_id = record["key"].rpartition("/")[2]
+            db.execute(
+                "INSERT INTO decisions VALUES (?, ?, ?) "
+                "ON CONFLICT(message_id) DO UPDATE SET "
+                "decision = excluded.decision, ts = excluded.ts "
+                "WHERE excluded.ts >= decisions.ts",
+                (message_id, record["result"], record["ts"]),
+            )
+            decision = decision_for(db, message_id)
+            db.execute(
+                "UPDATE emails SET decision = ? WHERE message_id = ? "
+                "AND decision != ?",
+                (decision, message_id, decision),
+            )
+            count += 1
+        db.execute("INSERT INTO audit_objects VALUES (?)", (audit_key,))
+        db.commit()
+    # La partición puede avanzar solo con objetos ya leídos
+    db.commit()
+    return count
+
+
+def sync_prefix(db, bucket, prefix, workers):
+    """
+    Indexa los emails nuevos o cambiados del prefijo, con un commit cada
+    COMMIT_EVERY emails: una sincronización interrumpida no pierde lo hecho.
+    """
+    count = 0
+    batch = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+
+        def index_batch(objects):
+            summaries = executor.map(
+                lambda obj: read_summary(bucket, obj["Key"], obj["ETag"]), objects
+            )
+            for obj, summary in zip(objects, summaries):
+                upsert(
+                    db,
+                    obj["Key"].rpartition("/")[2],
+                    obj["Key"],
+                    obj["ETag"],
+                    summary,
+                    obj["LastModified"].isoformat(),
+                )
+            db.commit()
+
+        for obj in pending_objects(db, bucket, prefix):
+            batch.append(obj)
+            if len(batch) >= COMMIT_EVERY:
+                index_batch(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            index_batch(batch)
+            count += len(batch)
+    return count
+
+
+def sync_archive(db, bucket, workers):
+    """
+    Indexa los bundles de no_relevante que aún no se han procesado.
+    """
+    count = 0
+    for page in list_pages(bucket, ARCHIVE_PREFIX):
+        for obj in page.get("Contents", []):
+            index_key = obj["Key"]
+            if not index_key.endswith(".index.json") or db.execute(
+                "SELECT 1 FROM archive_indexes WHERE key = ?", (index_key,)
+            ).fetchone():
+                continue
+            response = call("s3", s3.get_object, Bucket=bucket, Key=index_key)
+            index = json.loads(response["Body"].read())
+            entries = list(index["entries"].items())
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                raw_emails = executor.map(
+                    lambda item: read_bundle_entry(bucket, index["bundle"], item[1]),
+                    entries,
+                )
+                for (key, _), raw_email in zip(entries, raw_emails):
+                    upsert(
+                        db,
+                        key.rpartition("/")[2],
+                        key,
+                        None,
+                        summarize(parse_email_bytes(raw_email)),
+                        index["day"],
+                    )
+                    count += 1
+            db.execute("INSERT INTO archive_indexes VALUES (?)", (index_key,))
+            db.commit()
+    return count
+
+
+def sync(db, bucket, audit_sink=None, workers=8):
+    """
+    Actualiza el índice con los cambios en S3 desde la última sincronización.
+    Sin `audit_sink` todas las decisiones quedan como "unknown".
+    """
+    counts = {}
+    if audit_sink is not None:
+        counts["audit_records"] = sync_audit(db, bucket, audit_sink)
+    else:
+        logger.warning("Sin registro de auditoría; las decisiones serán unknown")
+    for prefix in FOLDERS:
+        counts[prefix] = sync_prefix(db, bucket, prefix, workers)
+    counts[ARCHIVE_PREFIX] = sync_archive(db, bucket, workers)
+    return counts
+
+
+def query(db, text, decision=None, limit=50, raw=False):
+    """
+    Búsqueda de texto completo sobre clave, remitente, asunto, referencia y
+    decisión. Salvo con `raw`, el texto se busca como frase literal.
+    """
+    if not raw:
+        text = '"' + text.replace('"', '""') + '"'
+    sql = (
+        "SELECT e.key, e.decision, e.sender, e.subject, e.booking_ref, "
+        "e.last_modified FROM emails_fts JOIN emails e ON e.rowid = emails_fts.rowid "
+        "WHERE emails_fts MATCH ?"
+    )
+    params = [text]
+    if decision:
+        sql += " AND e.decision = ?"
+        params.append(decision)
+    sql += " ORDER BY e.last_modified DESC LIMIT ?"
+    params.append(limit)
+    return db.execute(sql, params).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Índice de búsqueda del triaje")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sync_parser = subparsers.add_parser("sync")
+    sync_parser.add_argument("--bucket", required=True)
+    sync_parser.add_argument("--db", default="triage.db")
+    sync_parser.add_argument("--workers", type=int, default=8)
+    sync_parser.add_argument("--audit-bucket", default=os.getenv("AUDIT_BUCKET", ""))
+    sync_parser.add_argument(
+        "--audit-local-dir", default=os.getenv("AUDIT_LOCAL_DIR", "")
+    )
+    sync_parser.add_argument(
+        "--audit-prefix", default=os.getenv("AUDIT_PREFIX", "audit/")
+    )
+    query_parser = subparsers.add_parser("query")
+    query_parser.add_argument("text")
+    query_parser.add_argument("--db", default="triage.db")
+    query_parser.add_argument("--decision", choices=DECISIONS)
+    query_parser.add_argument(
+        "--raw", action="store_true", help="Usar el texto como consulta FTS5"
+    )
+    query_parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    db = connect(args.db)
+    if args.command == "sync":
+        audit_log = load_audit_log(
+            s3, args.audit_bucket, args.audit_local_dir, args.audit_prefix
+        )
+        sink = audit_log.sink if audit_log is not None else None
+        print(json.dumps(sync(db, args.bucket, sink, args.workers)))
+    else:
+        for row in query(db, args.text, args.decision, args.limit, args.raw):
+            print("\t".join(str(value or "") for value in row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Limitación por remitente antes de enviar al agente, para que un bucle de
+correo o un OTA con problemas no consuma el presupuesto del agente.
+
+Se combinan dos niveles:
+- un token bucket en memoria por remitente (por contenedor), que corta las
+  ráfagas sin llamadas externas;
+- un contador compartido por ventana de tiempo en DynamoDB con TTL (o en
+  memoria si no hay tabla configurada), que limita el total entre
+  contenedores.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from rate_limit import RateLimiter
+from resilience import call
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Número máximo de remitentes con bucket en memoria por contenedor
+MAX_LOCAL_SENDERS = 10000
+
+
+class LocalWindowCounter:
+    """
+    Contador por ventana en memoria; sustituye a la tabla de DynamoDB en local
+    o cuando no está configurada.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def increment(self, key, expires_at):
+        with self.lock:
+            now = time.time()
+            for expired in [k for k, (_, exp) in self.counts.items() if exp < now]:
+                del self.counts[expired]
+            count, _ = self.counts.get(key, (0, expires_at))
+            self.counts[key] = (count + 1, expires_at)
+            return count + 1
+
+
+class DynamoWindowCounter:
+    """
+    Contador por ventana compartido entre contenedores en una tabla de
+    DynamoDB con clave `pk` y TTL en `expires_at`.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def increment(self, key, expires_at):
+        response = call(
+            "dynamodb",
+            self.table.update_item,
+            Key={"pk": key},
+            UpdateExpression="ADD hits :one SET expires_at = :expires_at",
+            ExpressionAttributeValues={":one": 1, ":expires_at": expires_at},
+            ReturnValues="UPDATED_NEW",
+        )
+        return int(response["Attributes"]["hits"])
+
+
+class SenderRateLimiter:
+    """
+    Permite como máximo `limit_per_minute` emails por remitente, tanto en el
+    bucket local como en el contador compartido. Con limit_per_minute <= 0 no
+    limita.
+    """
+
+    def __init__(self, limit_per_minute, counter=None, window_seconds=60):
+        self.limit_per_minute = limit_per_minute
+        self.counter = counter or LocalWindowCounter()
+        self.window_seconds = window_seconds
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+
+    def _bucket(self, sender):
+        with self.lock:
+            bucket = self.buckets.get(sender)
+            if bucket is None:
+                bucket = RateLimiter(
+                    self.limit_per_minute / 60.0, burst=self.limit_per_minute
+                )
+                self.buckets[sender] = bucket
+                if len(self.buckets) > MAX_LOCAL_SENDERS:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(sender)
+            return bucket
+
+    def allow(self, sender):
+        """
+        Devuelve si el email de `sender` puede enviarse al agente.
+        """
+        if self.limit_per_minute <= 0 or not sender:
+            return True
+        sender = sender.strip().lower()
+        if not self._bucket(sender).try_acquire():
+            return False
+
+        window = int(time.time() // self.window_seconds)
+        limit = self.limit_per_minute * self.window_seconds / 60.0
+        try:
+            hits = self.counter.increment(
+                f"{sender}#{window}", (window + 2) * self.window_seconds
+            )
+        except Exception:
+            # Si el contador compartido falla se mantiene solo el límite local
+            logger.exception("Error actualizando el contador de envíos por remitente")
+            return True
+        return hits <= limit
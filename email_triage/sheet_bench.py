@@ -0,0 +1,159 @@
+"""
+Medición de la lectura de hojas de partners en modo read-only de openpyxl
+(capa python/lib/python3.12/site-packages).
+
+Compara sheets.iter_values con ws.iter_rows(values_only=True) de openpyxl
+(un dict por celda en parse_cell y la fila rellenada en
+ReadOnlyWorksheet._get_row) sobre un libro sintético con textos, números,
+fechas, booleanos y huecos. Mide filas por segundo y, con tracemalloc, el
+pico de memoria mientras se recorre la hoja.
+
+Si numpy está instalado mide también la carga de la hoja entera en columnas:
+con sheets.iter_batches (arrays tipados por columna) y transponiendo las
+filas de sheets.iter_values con numpy.array por columna.
+
+    PYTHONPATH=python/lib/python3.12/site-packages \\
+        python email_triage/sheet_bench.py --rows 100000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.utils import get_column_letter
+
+from sheets import iter_batches, iter_values
+
+try:
+    import numpy
+except ImportError:  # Dependencia opcional
+    numpy = None
+
+HEADER = ["reference", "partner", "amount", "pax", "travel_date", "paid", "notes"]
+COLUMNS = [get_column_letter(idx) for idx in range(1, len(HEADER) + 1)]
+# Tipos fijos para iter_batches, para que todos los lotes se puedan concatenar
+DTYPES = {"C": "float64", "D": "int64", "E": "datetime64[ms]", "F": "bool"}
+
+
+def build_workbook(path, rows, seed=42):
+    """
+    Libro de una hoja con `rows` filas de reservas sintéticas.
+    """
+    rng = random.Random(seed)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("bookings")
+    ws.append(HEADER)
+    start = datetime(2024, 1, 1)
+    for i in range(rows):
+        ws.append(
+            [
+                f"BK{i:08d}",
+                rng.choice(["Civitatis", "GetYourGuide", "Viator", "Klook"]),
+                round(rng.uniform(10, 900), 2),
+                rng.randint(1, 8),
+                start + timedelta(days=rng.randint(0, 365)),
+                rng.random() < 0.8,
+                rng.choice([None, None, "late check-in", "vegetarian"]),
+            ]
+        )
+    wb.save(path)
+
+
+def openpyxl_rows(ws):
+    return ws.iter_rows(values_only=True)
+
+
+def values_rows(ws):
+    return iter_values(ws)
+
+
+def consume(rows):
+    count = 0
+    for _ in rows:
+        count += 1
+    return count
+
+
+def rows_to_columns(ws):
+    """
+    Carga en columnas a partir de las filas.
+    """
+    rows = iter_values(ws, min_row=2, max_col=len(COLUMNS))
+    return [numpy.array(column) for column in zip(*rows)]
+
+
+def batches_to_columns(ws):
+    """
+    Carga en columnas con iter_batches.
+    """
+    batches = list(iter_batches(ws, columns=COLUMNS, min_row=2, dtypes=DTYPES))
+    return [numpy.ma.concatenate([b[col] for b in batches]) for col in COLUMNS]
+
+
+def measure_load(ws, load):
+    start = time.perf_counter()
+    load(ws)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    columns = load(ws)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "seconds": round(elapsed, 2),
+        "peak_kib": round(peak / 1024),
+        "dtypes": [str(column.dtype) for column in columns],
+    }
+
+
+def bench(path):
+    wb = load_workbook(path, read_only=True)
+    ws = wb.active
+    if list(openpyxl_rows(ws)) != list(values_rows(ws)):
+        raise AssertionError("Las filas de los dos caminos no coinciden")
+
+    results = {}
+    for name, rows in (("iter_rows", openpyxl_rows), ("iter_values", values_rows)):
+        start = time.perf_counter()
+        count = consume(rows(ws))
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        for _ in rows(ws):
+            pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results["rows"] = count
+        results[name] = {
+            "rows_per_sec": round(count / elapsed),
+            "peak_kib": round(peak / 1024),
+        }
+    if numpy is not None:
+        results["columns"] = {
+            "rows_to_columns": measure_load(ws, rows_to_columns),
+            "iter_batches": measure_load(ws, batches_to_columns),
+        }
+    wb.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lectura de hojas de partners")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--path", help="Libro a medir (por defecto uno sintético)")
+    args = parser.parse_args()
+    if args.path:
+        print(json.dumps(bench(args.path), indent=2))
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bookings.xlsx")
+        build_workbook(path, args.rows)
+        print(json.dumps(bench(path), indent=2))
+
+
+if __name__ == "__main__":
+    main()
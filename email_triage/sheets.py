@@ -0,0 +1,443 @@
+"""
+Lectura rápida de hojas de partners con openpyxl en modo read-only.
+
+openpyxl (capa python/lib/python3.12/site-packages, sin modificar) construye
+un dict por celda en WorkSheetParser.parse_cell y vuelve a rellenar cada fila
+en ReadOnlyWorksheet._get_row, también cuando solo se piden los valores.
+
+- iter_values(ws, ...) devuelve lo mismo que ws.iter_rows(values_only=True),
+  pero ValuesParser escribe el valor de cada celda directamente en un buffer
+  de fila reutilizado y lee las inline strings sin crear objetos Text.
+- iter_batches(ws, ...) lee la hoja por columnas, en lotes, como arrays de
+  numpy con tipo; las fechas y duraciones se convierten por columna entera
+  en lugar de celda a celda con from_excel.
+
+numpy es una dependencia opcional: solo la necesita iter_batches.
+
+Medición:
+    PYTHONPATH=python/lib/python3.12/site-packages \\
+        python email_triage/sheet_bench.py --rows 100000
+"""
+from string import digits
+from warnings import warn
+
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.utils.datetime import WINDOWS_EPOCH, from_excel, from_ISO8601
+from openpyxl.worksheet._reader import (
+    DATA_TAG,
+    FORMULA_TAG,
+    INLINE_STRING,
+    ROW_TAG,
+    SHEET_MAIN_NS,
+    VALUE_TAG,
+    WorkSheetParser,
+    _cast_number,
+    iterparse,
+    parse_richtext_string,
+)
+
+try:
+    import numpy
+except ImportError:  # Dependencia opcional
+    numpy = None
+
+TEXT_TAG = "{%s}t" % SHEET_MAIN_NS
+RICH_TEXT_TAG = "{%s}r" % SHEET_MAIN_NS
+
+# Seriales que from_excel convierte en fechas: desde 1900-01-01 (los menores
+# son horas) hasta 9999-12-31
+MIN_DATE_SERIAL = 1
+MAX_DATE_SERIAL = 2958466
+NUMBER_TYPES = {int, float}
+
+
+def parse_inline_text(element):
+    """
+    Texto de una inline string sin formato; equivale a
+    Text.from_tree(element).content sin construir los objetos.
+    """
+    snippets = []
+    for child in element:
+        if child.tag == TEXT_TAG:
+            text = child.text
+        elif child.tag == RICH_TEXT_TAG:
+            text = child.findtext(TEXT_TAG)
+        else:
+            continue
+        if text is not None:
+            snippets.append(text)
+    return "".join(snippets)
+
+
+class ValuesParser(WorkSheetParser):
+    """
+    WorkSheetParser con una versión de parse() que solo devuelve valores.
+    """
+
+    def set_row_counter(self, r):
+        """
+        Número de fila del atributo `r` (o la siguiente), como parse_row.
+        """
+        if r is not None:
+            try:
+                self.row_counter = int(r)
+            except ValueError:
+                val = float(r)
+                if not val.is_integer():
+                    raise ValueError(f"{r} is not a valid row number")
+                self.row_counter = int(val)
+        else:
+            self.row_counter += 1
+        self.col_counter = 0
+
+    def parse_values(self, min_col=1, max_col=None, date_kinds=None):
+        """
+        Devuelve (número de fila, tupla de valores) de las columnas min_col a
+        max_col, o hasta la última celda de cada fila si max_col es None, igual
+        que ReadOnlyWorksheet._get_row(values_only=True). Solo lee sheetData.
+
+        Con una lista en `date_kinds`, las celdas con formato de fecha
+        conservan el serial de Excel y, en cada fila, date_kinds[i] vale
+        "date" o "timedelta" para esas celdas y None para el resto, para
+        convertir columnas enteras de una vez.
+        """
+        # Los ids de estilo se comparan tal como aparecen en el XML
+        date_styles = {str(style_id) for style_id in self.date_formats}
+        timedelta_styles = {str(style_id) for style_id in self.timedelta_formats}
+        shared_strings = self.shared_strings
+        formulae = not self.data_only
+
+        width = 0 if max_col is None else max_col + 1 - min_col
+        blank = [None] * width
+        values = blank[:]
+        if date_kinds is not None:
+            date_kinds[:] = blank
+
+        for _, element in iterparse(self.source):
+            tag_name = element.tag
+            if tag_name != ROW_TAG:
+                if tag_name == DATA_TAG:
+                    break
+                continue
+
+            self.set_row_counter(element.get("r"))
+            if date_kinds is not None:
+                date_kinds[:] = blank
+            column = 0
+            for cell in element:
+                coordinate = cell.get("r")
+                if coordinate:
+                    column = column_index_from_string(coordinate.rstrip(digits))
+                else:
+                    column += 1
+
+                if column < min_col or max_col is not None and column > max_col:
+                    if formulae and cell.find(FORMULA_TAG) is not None:
+                        # Las fórmulas compartidas se definen en su primera celda
+                        self.parse_formula(cell)
+                    continue
+
+                data_type = cell.get("t", "n")
+                kind = None
+                if formulae and cell.find(FORMULA_TAG) is not None:
+                    value = self.parse_formula(cell)
+                elif data_type == "inlineStr":
+                    value = None
+                    child = cell.find(INLINE_STRING)
+                    if child is not None:
+                        if self.rich_text:
+                            value = parse_richtext_string(child)
+                        else:
+                            value = parse_inline_text(child)
+                else:
+                    value = cell.findtext(VALUE_TAG, None) or None
+                    if value is None:
+                        pass
+                    elif data_type == "n":
+                        value = _cast_number(value)
+                        style_id = cell.get("s", "0")
+                        if style_id not in date_styles:
+                            pass
+                        elif date_kinds is not None:
+                            if style_id in timedelta_styles:
+                                kind = "timedelta"
+                            else:
+                                kind = "date"
+                        else:
+                            value = excel_value(
+                                value,
+                                self.epoch,
+                                "timedelta" if style_id in timedelta_styles else "date",
+                                coordinate,
+                            )
+                    elif data_type == "s":
+                        value = shared_strings[int(value)]
+                    elif data_type == "b":
+                        value = bool(int(value))
+                    elif data_type == "d":
+                        value = from_ISO8601(value)
+
+                idx = column - min_col
+                if idx >= len(values):
+                    padding = [None] * (idx + 1 - len(values))
+                    values.extend(padding)
+                    blank.extend(padding)
+                    if date_kinds is not None:
+                        date_kinds.extend(padding)
+                values[idx] = value
+                if kind is not None:
+                    date_kinds[idx] = kind
+
+            if max_col is not None:
+                row = tuple(values)
+            elif column >= min_col:
+                # Hoja sin dimensiones: hasta la última celda de la fila
+                row = tuple(values[: column + 1 - min_col])
+            else:
+                row = ()
+            values[:] = blank
+            element.clear()
+            yield self.row_counter, row
+
+
+def excel_value(value, epoch, kind, coordinate=None):
+    """
+    Serial de Excel a fecha o duración, como parse_cell: los que quedan fuera
+    del rango de fechas se avisan y se devuelven como "#VALUE!".
+    """
+    try:
+        return from_excel(value, epoch, timedelta=kind == "timedelta")
+    except (OverflowError, ValueError):
+        cell = f"Cell {coordinate}" if coordinate else "The cell"
+        warn(
+            f"{cell} is marked as a date but the serial value {value} is outside "
+            "the limits for dates. The cell will be treated as an error."
+        )
+        return "#VALUE!"
+
+
+def values_by_row(ws, min_col, min_row, max_col, max_row, date_kinds=None):
+    """
+    ReadOnlyWorksheet._cells_by_row(values_only=True) con ValuesParser: crea
+    las filas que faltan en el XML.
+    """
+    max_col = max_col or ws.max_column
+    max_row = max_row or ws.max_row
+    empty_row = []
+    if max_col is not None:
+        empty_row = (None,) * (max_col + 1 - min_col)
+
+    counter = min_row
+    idx = 1
+    with ws._get_source() as src:
+        parser = ValuesParser(
+            src,
+            ws._shared_strings,
+            data_only=ws.parent.data_only,
+            epoch=ws.parent.epoch,
+            date_formats=ws.parent._date_formats,
+            timedelta_formats=ws.parent._timedelta_formats,
+        )
+        for idx, row in parser.parse_values(min_col, max_col, date_kinds):
+            if max_row is not None and idx > max_row:
+                break
+            # Filas ausentes
+            for _ in range(counter, idx):
+                counter += 1
+                yield empty_row
+            if counter <= idx:
+                counter += 1
+                yield row
+
+    if max_row is not None and max_row < idx:
+        for _ in range(counter, max_row + 1):
+            yield empty_row
+
+
+def iter_values(ws, min_row=None, max_row=None, min_col=None, max_col=None):
+    """
+    Valores de una hoja read-only por filas; el mismo resultado que
+    ws.iter_rows(min_row, max_row, min_col, max_col, values_only=True).
+    """
+    return values_by_row(
+        ws, min_col or 1, min_row or 1, max_col or ws.max_column, max_row or ws.max_row
+    )
+
+
+def excel_to_datetime64(serials, epoch=WINDOWS_EPOCH):
+    """
+    Array de seriales de Excel >= 1 a datetime64[ms], redondeando como
+    from_excel.
+    """
+    day, fraction = numpy.divmod(serials, 1)
+    diff = numpy.round(fraction * 86400 * 1000).astype("int64")
+    if epoch == WINDOWS_EPOCH:
+        # Excel cree que 1900 fue bisiesto
+        day += serials < 60
+    return (
+        numpy.datetime64(epoch, "ms")
+        + day.astype("int64").astype("timedelta64[D]")
+        + diff.astype("timedelta64[ms]")
+    )
+
+
+def excel_to_timedelta64(serials):
+    """
+    Array de duraciones en días a timedelta64[ms].
+    """
+    milliseconds = numpy.round(serials * 86400 * 1000).astype("int64")
+    return milliseconds.astype("timedelta64[ms]")
+
+
+def fill_value(dtype):
+    if dtype.kind in "mM":
+        return dtype.type("NaT")
+    if dtype.kind == "O":
+        return None
+    if dtype.kind in "SU":
+        return ""
+    return dtype.type(0)
+
+
+def cast_column(column, dtype):
+    """
+    Convierte un masked array de column_array a `dtype` conservando la
+    máscara. Los valores que no se pueden convertir lanzan ValueError o
+    TypeError.
+    """
+    dtype = numpy.dtype(dtype)
+    if column.dtype == dtype:
+        return column
+    mask = numpy.ma.getmaskarray(column)
+    data = column.data.astype(object)
+    data[mask] = fill_value(dtype)
+    return numpy.ma.MaskedArray(data.astype(dtype), mask=mask)
+
+
+def column_array(values, kinds, epoch=WINDOWS_EPOCH, dtype=None):
+    """
+    Valores de una columna como masked array, enmascarado donde la celda está
+    vacía. `kinds` tiene "date" o "timedelta" para los seriales de Excel de
+    las celdas con formato de fecha (ver ValuesParser.parse_values).
+
+    Sin `dtype`, las columnas solo con números son int64 o float64, solo con
+    booleanos bool, y las de fechas o duraciones datetime64[ms] o
+    timedelta64[ms]. El resto es un array object con los valores de
+    iter_values. Con `dtype` el resultado se convierte a ese tipo (ver
+    cast_column).
+    """
+    column = infer_column(values, kinds, epoch)
+    if dtype is not None:
+        column = cast_column(column, dtype)
+    return column
+
+
+def infer_column(values, kinds, epoch):
+    size = len(values)
+    data = numpy.fromiter(values, dtype=object, count=size)
+    mask = numpy.equal(data, None)
+    types = set(map(type, values))
+    types.discard(type(None))
+
+    date_kinds = set(kinds)
+    date_kinds.discard(None)
+    if date_kinds:
+        kind = date_kinds.pop()
+        undated = numpy.equal(numpy.fromiter(kinds, dtype=object, count=size), None)
+        dates_only = (
+            not date_kinds and types <= NUMBER_TYPES and not (undated & ~mask).any()
+        )
+        if dates_only:
+            serials = numpy.where(mask, 1, data).astype("float64")
+            if kind == "timedelta":
+                column = excel_to_timedelta64(serials)
+            elif serials.min() >= MIN_DATE_SERIAL and serials.max() < MAX_DATE_SERIAL:
+                column = excel_to_datetime64(serials, epoch)
+            else:
+                dates_only = False
+        if dates_only:
+            column[mask] = column.dtype.type("NaT")
+            return numpy.ma.MaskedArray(column, mask=mask)
+
+        # Columna mezclada: cada fecha se convierte como en iter_values
+        for idx, (value, kind) in enumerate(zip(values, kinds)):
+            if kind is not None and value is not None:
+                data[idx] = excel_value(value, epoch, kind)
+        return numpy.ma.MaskedArray(data, mask=mask)
+
+    if not types:
+        column = numpy.full(size, numpy.nan)
+    elif types == {bool}:
+        column = numpy.where(mask, False, data).astype(bool)
+    elif types == {int}:
+        try:
+            column = numpy.where(mask, 0, data).astype("int64")
+        except OverflowError:
+            column = data
+    elif types <= NUMBER_TYPES:
+        column = numpy.where(mask, numpy.nan, data).astype("float64")
+    else:
+        column = data
+    return numpy.ma.MaskedArray(column, mask=mask)
+
+
+def iter_batches(
+    ws, batch_rows=10000, columns=None, min_row=None, max_row=None, dtypes=None
+):
+    """
+    Lee una hoja read-only por columnas, en lotes de hasta `batch_rows` filas.
+
+    Por cada lote devuelve un dict de columna a masked array de numpy,
+    enmascarado donde la celda está vacía. `columns` es una lista de letras o
+    índices de columna (por defecto todas, por letra). Los tipos se deducen
+    como en column_array y por separado en cada lote, así que una columna
+    puede ser int64 en un lote y float64 u object en otro. `dtypes` fija el
+    tipo de cada columna (con la clave usada en `columns`) en todos los
+    lotes: las celdas enmascaradas se rellenan con 0, NaT, "" o None y los
+    valores que no se pueden convertir lanzan ValueError o TypeError.
+    """
+    if numpy is None:
+        raise ImportError("sheets.iter_batches necesita numpy")
+    if columns is None:
+        ws.calculate_dimension()
+        columns = [
+            get_column_letter(idx) for idx in range(ws.min_column, ws.max_column + 1)
+        ]
+    indices = [
+        column_index_from_string(col) if isinstance(col, str) else col
+        for col in columns
+    ]
+    min_col, max_col = min(indices), max(indices)
+    min_row = min_row or ws.min_row
+    dtypes = dtypes or {}
+
+    date_kinds = []
+    row_kinds = []
+    rows = []
+    kinds = []
+
+    def batch():
+        values = list(zip(*rows))
+        column_kinds = list(zip(*kinds))
+        rows.clear()
+        kinds.clear()
+        return {
+            col: column_array(
+                values[idx - min_col],
+                column_kinds[idx - min_col],
+                ws.parent.epoch,
+                dtypes.get(col),
+            )
+            for col, idx in zip(columns, indices)
+        }
+
+    for row in values_by_row(ws, min_col, min_row, max_col, max_row, date_kinds):
+        rows.append(row)
+        # Las filas con las mismas columnas de fecha comparten sus kinds
+        if date_kinds != row_kinds:
+            row_kinds = date_kinds[:]
+        kinds.append(row_kinds)
+        if len(rows) == batch_rows:
+            yield batch()
+    if rows:
+        yield batch()
@@ -0,0 +1,334 @@
+"""
+Generador de emails sintéticos de OTAs para pruebas de carga.
+
+Genera emails MIME parametrizados (multipart/alternative, multiparts anidados,
+tablas HTML grandes como las de Viator, adjuntos PDF, charsets latin-1 y
+windows-1252) y sus notificaciones SES envueltas en eventos SQS, como las que
+recibe lambda_handler. La salida es determinista por semilla: el email i solo
+depende de (seed, i).
+
+Uso:
+    python email_triage/synthetic_corpus.py generate --count 10000 --seed 42 \
+        --out corpus/
+    python email_triage/synthetic_corpus.py bench --count 5000 --seed 42
+"""
+import argparse
+import base64
+import binascii
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from email.header import Header
+
+OTAS = [
+    ("Viator", "booking@t1.viator.com"),
+    ("GetYourGuide", "partner@notification.getyourguide.com"),
+    ("Civitatis", "reservas@civitatis.com"),
+    ("Tiqets", "bookings@tiqets.com"),
+]
+IRRELEVANT_SENDERS = [
+    ("Ofertas Canarias", "news@promo.ofertas-canarias.es"),
+    ("Facturación", "facturas@proveedor-ejemplo.es"),
+    ("", "mailer-daemon@amazonses.com"),
+]
+RECIPIENT = "test-vimotions-insular@tripilots.com"
+TRAVELERS = [
+    "JOSÉ MANUEL DÍAZ ALONSO",
+    "María Núñez Peña",
+    "Jürgen Müller",
+    "Zoë Brontë",
+    "Françoise Lefèvre",
+    "Ana Guerra",
+]
+TOURS = [
+    "2-Hours Spa Circuit in Costa Adeje",
+    "Excursión en barco por Los Gigantes",
+    "Avistamiento de cetáceos en Tenerife",
+    "Teide Stargazing Tour",
+]
+CHARSETS = ["utf-8", "utf-8", "iso-8859-1", "windows-1252"]
+SHAPES = ["plain", "alternative", "nested", "html_table"]
+BASE_DATE = datetime(2024, 12, 1, 8, 0, tzinfo=timezone.utc)
+
+
+def encode_text(text, charset, rng):
+    """
+    Codifica un texto con su charset y un Content-Transfer-Encoding aleatorio.
+    Devuelve el payload en bytes: en 8bit son los bytes del charset tal cual
+    (latin-1 o windows-1252 de verdad, no UTF-8).
+    """
+    raw = text.encode(charset, errors="replace")
+    encoding = rng.choice(["quoted-printable", "base64", "8bit"])
+    if encoding == "quoted-printable":
+        payload = binascii.b2a_qp(raw)
+    elif encoding == "base64":
+        payload = base64.encodebytes(raw)
+    else:
+        payload = raw
+    return encoding, payload
+
+
+def text_part(subtype, text, charset, rng):
+    encoding, payload = encode_text(text, charset, rng)
+    headers = (
+        f"Content-Type: text/{subtype}; charset=\"{charset}\"\r\n"
+        f"Content-Transfer-Encoding: {encoding}\r\n\r\n"
+    )
+    return headers.encode("ascii") + payload + b"\r\n"
+
+
+def binary_part(content_type, filename, data):
+    headers = (
+        f"Content-Type: {content_type}; name=\"{filename}\"\r\n"
+        f"Content-Disposition: attachment; filename=\"{filename}\"\r\n"
+        "Content-Transfer-Encoding: base64\r\n\r\n"
+    )
+    return headers.encode("ascii") + base64.encodebytes(data) + b"\r\n"
+
+
+def multipart(subtype, parts, boundary):
+    delimiter = f"--{boundary}\r\n".encode("ascii")
+    header = f"Content-Type: multipart/{subtype}; boundary=\"{boundary}\"\r\n\r\n"
+    return (
+        header.encode("ascii")
+        + b"".join(delimiter + part for part in parts)
+        + f"--{boundary}--\r\n".encode("ascii")
+    )
+
+
+def booking_details(rng):
+    travel_date = BASE_DATE + timedelta(days=rng.randint(0, 120))
+    return {
+        "reference": f"BR-{rng.randint(10**9, 10**10 - 1)}",
+        "tour": rng.choice(TOURS),
+        "traveler": rng.choice(TRAVELERS),
+        "travelers": rng.randint(1, 6),
+        "travel_date": travel_date.strftime("%a, %b %d, %Y"),
+        "product_code": f"{rng.randint(10000, 99999)}P{rng.randint(1, 999)}",
+        "net_rate": f"EUR €{rng.randint(15, 400)},{rng.randint(0, 99):02d}",
+    }
+
+
+def booking_plain(d):
+    return (
+        "Booking Confirmation\n"
+        f"Booking Reference: {d['reference']}\n"
+        f"Tour Name: {d['tour']}\n"
+        f"Travel Date: {d['travel_date']}\n"
+        f"Lead Traveler Name: {d['traveler']}\n"
+        f"Travelers: {d['travelers']} Adult\n"
+        f"Product Code: {d['product_code']}\n"
+        f"Net Rate: {d['net_rate']}\n"
+    )
+
+
+def booking_html(d, extra_rows=0, rng=None):
+    rows = [
+        ("Booking Reference", d["reference"]),
+        ("Tour Name", d["tour"]),
+        ("Travel Date", d["travel_date"]),
+        ("Lead Traveler Name", d["traveler"]),
+        ("Travelers", f"{d['travelers']} Adult"),
+        ("Product Code", d["product_code"]),
+        ("Net Rate", d["net_rate"]),
+    ]
+    for i in range(extra_rows):
+        rows.append((f"Detail {i}", f"{rng.random():.6f}" if rng else str(i)))
+    cells = "".join(
+        f'<tr><td style="font-weight:bold;padding:4px">{k}</td>'
+        f'<td style="padding:4px">{v}</td></tr>'
+        for k, v in rows
+    )
+    return (
+        "<html><body><table><tr><td>Booking Confirmation</td></tr></table>"
+        f'<table width="600" cellpadding="0" cellspacing="0">{cells}</table>'
+        "<p>Have questions or need help?</p></body></html>"
+    )
+
+
+def generate_email(seed, index, relevant_ratio=0.7, table_rows=200):
+    """
+    Genera el email `index` de la semilla `seed`. Devuelve (message_id,
+    remitente, bytes del email, metadatos).
+    """
+    rng = random.Random(f"{seed}:{index}")
+    relevant = rng.random() < relevant_ratio
+    name, sender = rng.choice(OTAS if relevant else IRRELEVANT_SENDERS)
+    charset = rng.choice(CHARSETS)
+    shape = rng.choice(SHAPES)
+    details = booking_details(rng)
+    received = BASE_DATE + timedelta(seconds=index)
+    message_id = f"{seed:x}{index:012x}{rng.getrandbits(64):016x}"
+
+    if relevant:
+        subject = (
+            f"New Booking for {details['travel_date']} (#{details['reference']})"
+        )
+        plain = booking_plain(details)
+        html = booking_html(details)
+    else:
+        subject = "Ofertas de temporada en Canarias"
+        plain = "Descubre nuestras ofertas exclusivas de invierno. ¡No te pierdas!\n"
+        html = f"<html><body><p>{plain}</p></body></html>"
+
+    boundary = f"=_b{index}_{rng.getrandbits(32):08x}"
+    if shape == "plain":
+        content = text_part("plain", plain, charset, rng)
+    elif shape == "html_table":
+        if relevant:
+            html = booking_html(details, table_rows, rng)
+        content = text_part("html", html, charset, rng)
+    else:
+        alternative = multipart(
+            "alternative",
+            [
+                text_part("plain", plain, charset, rng),
+                text_part("html", html, charset, rng),
+            ],
+            boundary + "a",
+        )
+        content = alternative
+    if shape == "nested":
+        related = multipart(
+            "related",
+            [alternative, binary_part("image/png", "logo.png", rng.randbytes(2048))],
+            boundary + "r",
+        )
+        attachments = [related]
+        if relevant and rng.random() < 0.5:
+            pdf = b"%PDF-1.4\n" + rng.randbytes(rng.randint(10_000, 200_000))
+            filename = f"voucher-{details['reference']}.pdf"
+            attachments.append(binary_part("application/pdf", filename, pdf))
+        content = multipart("mixed", attachments, boundary + "m")
+
+    from_header = f"{Header(name, 'utf-8').encode()} <{sender}>" if name else sender
+    headers = (
+        f"From: {from_header}\r\n"
+        f"To: Booking VIMOTIONS <{RECIPIENT}>\r\n"
+        f"Subject: {Header(subject, 'utf-8').encode()}\r\n"
+        f"Date: {received.strftime('%a, %d %b %Y %H:%M:%S +0000')}\r\n"
+        f"Message-ID: <{message_id}@synthetic.tripilots.test>\r\n"
+        "MIME-Version: 1.0\r\n"
+    )
+    metadata = {
+        "relevant": relevant,
+        "shape": shape,
+        "charset": charset,
+        "received": received.isoformat(),
+    }
+    # Cabeceras en ASCII (Header codifica lo que no lo es); cada parte lleva
+    # ya los bytes de su charset
+    return message_id, sender, headers.encode("ascii") + content, metadata
+
+
+def ses_event(message_id, sender, received, bucket, prefix="emails/"):
+    """
+    Evento SQS con la notificación SES (acción S3) del email, en el formato
+    que espera lambda_handler.
+    """
+    timestamp = received.isoformat().replace("+00:00", "Z")
+    notification = {
+        "notificationType": "Received",
+        "mail": {
+            "timestamp": timestamp,
+            "source": sender,
+            "messageId": message_id,
+            "destination": [RECIPIENT],
+        },
+        "receipt": {
+            "timestamp": timestamp,
+            "recipients": [RECIPIENT],
+            "action": {
+                "type": "S3",
+                "bucketName": bucket,
+                "objectKeyPrefix": prefix,
+                "objectKey": prefix + message_id,
+            },
+        },
+    }
+    return {
+        "Records": [
+            {
+                "messageId": message_id,
+                "body": json.dumps(notification),
+                "attributes": {
+                    "ApproximateReceiveCount": "1",
+                    "SentTimestamp": str(int(received.timestamp() * 1000)),
+                },
+            }
+        ]
+    }
+
+
+def generate(out_dir, count, seed, bucket, relevant_ratio):
+    """
+    Escribe los emails en out_dir/emails/, los eventos en out_dir/events.jsonl
+    y los remitentes válidos en out_dir/allowlist.txt.
+    """
+    os.makedirs(os.path.join(out_dir, "emails"), exist_ok=True)
+    with open(os.path.join(out_dir, "events.jsonl"), "w") as events:
+        for i in range(count):
+            message_id, sender, raw_email, metadata = generate_email(
+                seed, i, relevant_ratio
+            )
+            with open(os.path.join(out_dir, "emails", message_id), "wb") as f:
+                f.write(raw_email)
+            received = datetime.fromisoformat(metadata["received"])
+            events.write(json.dumps(ses_event(message_id, sender, received, bucket)))
+            events.write("\n")
+    with open(os.path.join(out_dir, "allowlist.txt"), "w") as f:
+        f.write("\n".join(email for _, email in OTAS) + "\n")
+
+
+def bench(count, seed, relevant_ratio):
+    """
+    Mide la generación y el camino de decisión del handler (parseo, email
+    combinado y comprobación del remitente) sin acceso a AWS.
+    """
+    from app import build_combined_email
+    from email_utils import parse_email_bytes, should_email_be_processed
+
+    start = time.perf_counter()
+    corpus = [generate_email(seed, i, relevant_ratio)[2] for i in range(count)]
+    generated = time.perf_counter() - start
+
+    valid_emails = {email for _, email in OTAS}
+    start = time.perf_counter()
+    forwarded = 0
+    for raw_email in corpus:
+        combined_email = build_combined_email(parse_email_bytes(raw_email))
+        forwarded += should_email_be_processed(combined_email, valid_emails)
+    triaged = time.perf_counter() - start
+
+    return {
+        "emails": count,
+        "bytes": sum(len(raw_email) for raw_email in corpus),
+        "generate_per_sec": round(count / generated),
+        "triage_per_sec": round(count / triaged),
+        "forwarded": forwarded,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Corpus sintético de emails de OTAs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name in ("generate", "bench"):
+        sub = subparsers.add_parser(name)
+        sub.add_argument("--count", type=int, default=1000)
+        sub.add_argument("--seed", type=int, default=42)
+        sub.add_argument("--relevant-ratio", type=float, default=0.7)
+        if name == "generate":
+            sub.add_argument("--out", default="corpus")
+            sub.add_argument("--bucket", default="booking-automation-email-test")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        generate(args.out, args.count, args.seed, args.bucket, args.relevant_ratio)
+    else:
+        print(json.dumps(bench(args.count, args.seed, args.relevant_ratio), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Índice de conversaciones por Message-ID / In-Reply-To / References.
+
+Cada email enviado al agente se asocia a un thread_id (hash corto del primer
+mensaje de la conversación) que se guarda en un índice con TTL (tabla de
+DynamoDB o, en local, memoria). Las respuestas encuentran su conversación
+aunque el cliente de correo haya recortado la cabecera References.
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+
+from resilience import call
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+MESSAGE_ID_PATTERN = re.compile(r"<([^<>\s]+)>")
+# Referencias más recientes que se consultan en el índice
+MAX_LOOKUPS = 5
+
+
+def parse_message_ids(value):
+    """
+    Extrae los Message-ID (sin <>) de una cabecera, en orden.
+    """
+    if not value:
+        return []
+    ids = MESSAGE_ID_PATTERN.findall(str(value))
+    if not ids and str(value).strip():
+        ids = [str(value).strip()]
+    return [i.strip().lower() for i in ids]
+
+
+def make_thread_id(root_message_id):
+    return hashlib.blake2b(root_message_id.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class LocalThreadIndex:
+    """
+    Índice message_id -> thread_id en memoria.
+    """
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.items = {}
+
+    def get(self, message_id):
+        with self.lock:
+            thread_id, expires_at = self.items.get(message_id, (None, 0))
+            return thread_id if expires_at >= time.time() else None
+
+    def put(self, message_id, thread_id):
+        with self.lock:
+            self.items[message_id] = (thread_id, time.time() + self.ttl_seconds)
+
+
+class DynamoThreadIndex:
+    """
+    Índice message_id -> thread_id en una tabla de DynamoDB con clave `pk` y
+    TTL en `expires_at`.
+    """
+
+    def __init__(self, table, ttl_seconds):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, message_id):
+        item = call("dynamodb", self.table.get_item, Key={"pk": message_id}).get("Item")
+        return item.get("thread_id") if item else None
+
+    def put(self, message_id, thread_id):
+        call(
+            "dynamodb",
+            self.table.put_item,
+            Item={
+                "pk": message_id,
+                "thread_id": thread_id,
+                "expires_at": int(time.time() + self.ttl_seconds),
+            }
+        )
+
+
+def resolve_thread(headers, index):
+    """
+    Devuelve (thread_id, es_respuesta) para un email y lo registra en el
+    índice. Devuelve (None, False) si el email no tiene Message-ID.
+    """
+    message_ids = parse_message_ids(headers.get("message_id"))
+    in_reply_to = parse_message_ids(headers.get("in_reply_to"))
+    references = parse_message_ids(headers.get("references"))
+    parents = list(dict.fromkeys(in_reply_to + references[::-1]))
+    if not message_ids:
+        if not parents:
+            return None, False
+        # Sin Message-ID propio se agrupa igualmente por sus referencias
+        message_ids = [None]
+    message_id = message_ids[0]
+
+    thread_id = None
+    try:
+        for parent in parents[:MAX_LOOKUPS]:
+            thread_id = index.get(parent)
+            if thread_id:
+                break
+    except Exception:
+        logger.exception("Error consultando el índice de conversaciones")
+
+    if not thread_id:
+        roots = references or in_reply_to or [message_id]
+        thread_id = make_thread_id(roots[0])
+
+    if message_id:
+        try:
+            index.put(message_id, thread_id)
+        except Exception:
+            logger.exception("Error actualizando el índice de conversaciones")
+    return thread_id, bool(parents)
@@ -0,0 +1,217 @@
+"""
+Modo worker: consume email-triage-queue directamente, sin Lambda, para
+ejecutar el triaje en un contenedor de larga duración (temporada alta de un
+tenant con mucho volumen).
+
+Cada proceso del pool hace long polling (lotes de 10, esperas de 20 s),
+procesa el lote con el mismo pipeline que lambda_handler repartiendo los
+registros entre `--threads` hilos, borra los procesados con
+DeleteMessageBatch y deja los fallidos para que SQS los reintente cuando
+venza su visibilidad (o los lleve a la DLQ). Mientras un lote está en curso
+se extiende su visibilidad para que un email lento no se entregue dos veces.
+
+Uso:
+    python email_triage/worker.py --queue-url <url> --processes 4 --threads 8
+
+SIGTERM/SIGINT terminan el lote en curso y paran.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+MAX_BATCH = 10
+WAIT_TIME_SECONDS = 20
+VISIBILITY_TIMEOUT = 60
+
+
+def to_lambda_record(message):
+    """
+    Convierte un mensaje de ReceiveMessage al formato de registro del evento
+    SQS de Lambda que entienden los adaptadores de events.py.
+    """
+    return {
+        "eventSource": "aws:sqs",
+        "messageId": message["MessageId"],
+        "body": message["Body"],
+        "attributes": message.get("Attributes", {}),
+    }
+
+
+class VisibilityExtender:
+    """
+    Hilo que, mientras el lote está en curso, vuelve a fijar la visibilidad
+    de sus mensajes a `visibility_timeout` cada mitad de ese tiempo.
+    """
+
+    def __init__(self, sqs_client, queue_url, messages, visibility_timeout):
+        self.sqs = sqs_client
+        self.queue_url = queue_url
+        self.messages = messages
+        self.visibility_timeout = visibility_timeout
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        from resilience import call
+
+        while not self.stopped.wait(self.visibility_timeout / 2):
+            try:
+                call(
+                    "sqs",
+                    self.sqs.change_message_visibility_batch,
+                    QueueUrl=self.queue_url,
+                    Entries=[
+                        {
+                            "Id": str(i),
+                            "ReceiptHandle": m["ReceiptHandle"],
+                            "VisibilityTimeout": self.visibility_timeout,
+                        }
+                        for i, m in enumerate(self.messages)
+                    ],
+                )
+                logger.info(f"Visibilidad extendida para {len(self.messages)} mensajes")
+            except Exception:
+                logger.exception("No se pudo extender la visibilidad del lote")
+
+
+def run_worker(queue_url, threads, visibility_timeout, stop_event=None):
+    """
+    Bucle de un proceso: recibe, procesa y borra lotes hasta `stop_event`.
+    Devuelve el número de mensajes procesados con éxito.
+    """
+    # Los clientes de boto3 se crean en cada proceso al importar app
+    from app import process_records, sqs
+    from events import sqs_records
+    from resilience import call
+
+    stop_event = stop_event or threading.Event()
+    processed = 0
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        while not stop_event.is_set():
+            try:
+                response = call(
+                    "sqs",
+                    sqs.receive_message,
+                    QueueUrl=queue_url,
+                    MaxNumberOfMessages=MAX_BATCH,
+                    WaitTimeSeconds=WAIT_TIME_SECONDS,
+                    VisibilityTimeout=visibility_timeout,
+                    AttributeNames=[
+                        "ApproximateReceiveCount",
+                        "ApproximateFirstReceiveTimestamp",
+                        "SentTimestamp",
+                    ],
+                )
+            except Exception:
+                logger.exception("Error recibiendo mensajes de SQS")
+                stop_event.wait(1)
+                continue
+            messages = response.get("Messages", [])
+            if not messages:
+                continue
+
+            with VisibilityExtender(sqs, queue_url, messages, visibility_timeout):
+                # Un mensaje que no se puede adaptar falla solo, sin el lote
+                records, failures = [], set()
+                for m in messages:
+                    try:
+                        records.extend(sqs_records(to_lambda_record(m)))
+                    except Exception:
+                        logger.exception(f"Mensaje {m['MessageId']} no válido")
+                        failures.add(m["MessageId"])
+                try:
+                    failures.update(process_records(records, executor))
+                except Exception:
+                    logger.exception("Error procesando el lote")
+                    failures = {m["MessageId"] for m in messages}
+
+            done = [m for m in messages if m["MessageId"] not in failures]
+            if done:
+                try:
+                    response = call(
+                        "sqs",
+                        sqs.delete_message_batch,
+                        QueueUrl=queue_url,
+                        Entries=[
+                            {"Id": str(i), "ReceiptHandle": m["ReceiptHandle"]}
+                            for i, m in enumerate(done)
+                        ],
+                    )
+                    for failed in response.get("Failed", []):
+                        logger.error(f"No se pudo borrar el mensaje: {failed}")
+                except Exception:
+                    logger.exception("Error en DeleteMessageBatch")
+            processed += len(done)
+            logger.info(
+                f"Lote de {len(messages)} mensajes: {len(done)} procesados, "
+                f"{len(failures)} fallidos"
+            )
+    return processed
+
+
+def worker_process(queue_url, threads, visibility_timeout):
+    """
+    Punto de entrada de cada proceso del pool.
+    """
+    logging.basicConfig(level=logging.INFO)
+    stop_event = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop_event.set())
+    processed = run_worker(queue_url, threads, visibility_timeout, stop_event)
+    logger.info(f"Worker {os.getpid()} parado tras procesar {processed} mensajes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker SQS del triaje de emails")
+    parser.add_argument("--queue-url", default=os.getenv("TRIAGE_QUEUE_URL"))
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--visibility-timeout", type=int, default=VISIBILITY_TIMEOUT)
+    args = parser.parse_args()
+    if not args.queue_url:
+        parser.error("Falta --queue-url (o TRIAGE_QUEUE_URL)")
+
+    # spawn: cada proceso importa app y crea sus propios clientes
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=worker_process,
+            args=(args.queue_url, args.threads, args.visibility_timeout),
+        )
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+
+    def stop(*_):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        stop()
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    main()